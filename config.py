@@ -17,6 +17,23 @@ class Config:
   MATING_STRATEGY = "matingStrategy"
 
   RECORD_FREQUENCY = "recordFrequency"
+  BACKGROUND_OUTPUT = "backgroundOutput"
+  OUTPUT_QUEUE_SIZE = "outputQueueSize"
+  CHECKPOINT_INTERVAL = "checkpointInterval"
+  CHECKPOINT_COMPRESSION = "checkpointCompression"
+  TRAJECTORY = "trajectory"
+
+  ENGINE = "engine"
+  SHARD_WORKERS = "shardWorkers"
+
+  ISLANDS = "islands"
+  MIGRATION_INTERVAL = "migrationInterval"
+  MIGRANTS = "migrants"
+
+  SIMILARITY_METRIC = "similarityMetric"
+  SIMILARITY_CACHE_SIZE = "similarityCacheSize"
+  COLOR_CLUSTERING = "colorClustering"
+  FACTOR_STATS = "factorStats"
 
   configValues = {
     GENERATIONS: 1200,
@@ -31,7 +48,21 @@ class Config:
     OBSTACLES: [],
     SENSE_DISTANCE: 5,
     MATING_STRATEGY: 1, # 0 for random mating, 1 for mating based on genetic similarity, 2 for mating based on location
-    RECORD_FREQUENCY: 200
+    RECORD_FREQUENCY: 200,
+    BACKGROUND_OUTPUT: True, # draw and encode the recorded generations in a separate process while the simulation carries on
+    OUTPUT_QUEUE_SIZE: 512, # the most snapshots (mostly frames) that can wait to be drawn before the simulation waits for the output to catch up
+    CHECKPOINT_INTERVAL: 50, # how many generations pass between saving a checkpoint that the run can be resumed from (0 to never save one)
+    CHECKPOINT_COMPRESSION: False, # whether to compress checkpoints (smaller, but slower to save)
+    TRAJECTORY: False, # record every organism's location and last move after every step of every generation to memory-mapped .npy files in the output folder
+    ENGINE: "object", # "object" to step each Organism through the Grid one at a time, "array" to step the whole population as numpy arrays, "sharded" to split the array engine's work between processes
+    SHARD_WORKERS: 0, # the number of worker processes used by the "sharded" engine (0 for one per core)
+    ISLANDS: 1, # the number of separate populations (each in its own process) to evolve side by side
+    MIGRATION_INTERVAL: 10, # how many generations pass between islands sending survivors to their neighbour (0 to never migrate)
+    MIGRANTS: 5, # how many survivors each island sends to its neighbour when migrating
+    SIMILARITY_METRIC: "weighted", # "weighted" to score how alike the best matching genes are, "hamming" to count the bits that differ between the gene codes
+    SIMILARITY_CACHE_SIZE: 100000, # the most genome pair similarities to remember between generations
+    COLOR_CLUSTERING: "graph", # "graph" to group similar genomes through a sparse neighbour graph, "dense" to compare every pair of organisms
+    FACTOR_STATS: True # record the distribution of every generation's similarity factors (which means calculating them for every generation)
   }
 
   @staticmethod
@@ -1,9 +1,12 @@
 from typing import List
-import random
+import copy
 import math
+import numpy as np
 
-from .node import NodeType, Node, NodeConnection
+from config import Config
+from .node import NodeType, Node, NodeConnection, SenseTypes, ActionTypes
 from .genome import Genome, Gene
+from .rng import randomStreams, ACTIONS
 
 class Action:
     def __init__(self, id: int, value: float):
@@ -21,6 +24,22 @@ class Brain:
         self.actionNodes = list(nodeMap[NodeType.ACTION].values())
 
         self.removeUselessConnections()
+        self.compile()
+
+    # every node in a brain is given a fixed slot in a flat array of values: first all of the sense nodes,
+    # then the inner nodes, then the action nodes. This layout is shared by every brain so that brains can
+    # be evaluated in bulk.
+    @staticmethod
+    def slotCount() -> int:
+        return SenseTypes.count() + Config.get(Config.NUM_INTERNAL_NODES) + ActionTypes.count()
+
+    @staticmethod
+    def slotIndex(type: NodeType, id: int) -> int:
+        if type == NodeType.SENSE:
+            return id
+        if type == NodeType.INNER:
+            return SenseTypes.count() + id
+        return SenseTypes.count() + Config.get(Config.NUM_INTERNAL_NODES) + id
 
     # given a set of genes create a network of sense, inner, and action nodes with node connections
     # between them. 
@@ -72,29 +91,122 @@ class Brain:
         self.senseNodes = [node for node in self.senseNodes if not node.willDelete]
         self.actionNodes = [node for node in self.actionNodes if not node.willDelete]
 
+    # the wiring of a brain never changes once it has been created, so flatten the node graph into a plan
+    # of (source slot, target slot, weight) connections. Connections are ordered the same way the node graph
+    # would apply them (inner nodes, then action nodes, with each node's incoming connections in gene order),
+    # so running through the plan once gives exactly the same values as walking the nodes
+    def compile(self):
+        sources, targets, weights = [], [], []
+        for node in [*self.innerNodes, *self.actionNodes]:
+            for conn in node.connections:
+                if conn.output == node:
+                    sources.append(Brain.slotIndex(conn.input.type, conn.input.id))
+                    targets.append(Brain.slotIndex(node.type, node.id))
+                    weights.append(conn.weight)
 
-    # determine which actions this individual will take given the NodeConnections and 
-    # populated sense nodes. Each action node will end up generating a value between 0 and 1,
-    # which is the probability that action will be taken.
-    def determineAction(self) -> list[Action]:
-        actions = []
+        self.sources = np.array(sources, dtype=np.int32)
+        self.targets = np.array(targets, dtype=np.int32)
+        self.weights = np.array(weights, dtype=np.float64)
 
-        for node in [*self.innerNodes, *self.actionNodes]:
-            node.applyConnections()
+        self.senseIds = [node.id for node in self.senseNodes]
+        self.actionIds = [node.id for node in self.actionNodes]
+        self.actionSlots = [Brain.slotIndex(node.type, node.id) for node in self.actionNodes]
 
-        actions: List[int] = []
-        for node in self.actionNodes:
+        self.plan = list(zip(sources, targets, weights))
+        self.targetSlots = sorted(set(targets))
+        self.values = [0.0] * Brain.slotCount()
+
+
+    # determine which actions this individual will take given the values of its sense nodes (in the same
+    # order as senseIds). Each action node will end up generating a value between 0 and 1,
+    # which is the probability that action will be taken.
+    def determineAction(self, senseValues: list[float]) -> list[Action]:
+        values = self.values
+        for slot in self.targetSlots:
+            values[slot] = 0.0
+        for senseId, value in zip(self.senseIds, senseValues):
+            values[senseId] = value
+
+        for source, target, weight in self.plan:
+            values[target] += values[source] * weight
+
+        actions: List[Action] = []
+        for actionId, slot in zip(self.actionIds, self.actionSlots):
             # convert the node value to a value between 0 and 1
-            triggerChance = ( math.tanh(node.value) + 1 ) / 2
+            triggerChance = ( math.tanh(values[slot]) + 1 ) / 2
 
             # some actions are binary (either occur or don't), but others change float values on
             # the individual so we need to pass back both the id and the value
-            if random.random() < triggerChance:
-                actions.append(Action(node.id, triggerChance))
+            if randomStreams.buffered(ACTIONS).random() < triggerChance:
+                actions.append(Action(actionId, triggerChance))
 
         return actions
-    
-    # reset all node values to 0
-    def clearNodes(self):
-        for node in [*self.senseNodes, *self.innerNodes, *self.actionNodes]:
-            node.reset()
\ No newline at end of file
+
+# all of the brains in a generation packed together so that they can be run in one pass. Each brain's plan is
+# laid out as a row of padded (organisms x connections) arrays, with padding connections reading from and writing
+# to a spare slot with a weight of 0. Running the columns in order applies every brain's connections in the same
+# order as Brain.determineAction, so the action values are identical to running the brains one at a time
+class BrainBatch:
+    def __init__(self, brains: list[Brain]):
+        self.count = len(brains)
+        self.width = max((len(brain.plan) for brain in brains), default=0)
+        self.padSlot = Brain.slotCount()
+        self.actionStart = Brain.slotIndex(NodeType.ACTION, 0)
+
+        self.sources = np.full((self.count, self.width), self.padSlot, dtype=np.int32)
+        self.targets = np.full((self.count, self.width), self.padSlot, dtype=np.int32)
+        self.weights = np.zeros((self.count, self.width))
+        self.hasAction = np.zeros((self.count, ActionTypes.count()), dtype=bool)
+        # the position of each action among its brain's action nodes (the order Brain.determineAction returns them in)
+        self.actionOrder = np.full((self.count, ActionTypes.count()), -1, dtype=np.int32)
+        self.hasSense = np.zeros((self.count, SenseTypes.count()), dtype=bool)
+
+        for index, brain in enumerate(brains):
+            length = len(brain.plan)
+            self.sources[index, :length] = brain.sources
+            self.targets[index, :length] = brain.targets
+            self.weights[index, :length] = brain.weights
+            self.hasAction[index, brain.actionIds] = True
+            self.actionOrder[index, brain.actionIds] = np.arange(len(brain.actionIds))
+            self.hasSense[index, brain.senseIds] = True
+
+    # the senses that at least one of the brains is wired to
+    def usedSenses(self) -> list[int]:
+        return np.flatnonzero(self.hasSense.any(axis=0)).tolist()
+
+    # return the value of every action node in every brain given a (organisms x SenseTypes) matrix of sense values
+    def getActionValues(self, senses: np.ndarray) -> np.ndarray:
+        values = np.zeros((self.count, self.padSlot + 1))
+        values[:, :SenseTypes.count()] = senses
+
+        rows = np.arange(self.count)
+        for column in range(self.width):
+            sources = self.sources[:, column]
+            targets = self.targets[:, column]
+            values[rows, targets] += values[rows, sources] * self.weights[:, column]
+
+        return values[:, self.actionStart:self.actionStart + ActionTypes.count()]
+
+    # return the chance (between 0 and 1) of every action being taken by every organism. As with a single brain, each
+    # action node's value is converted to a trigger chance, and actions that are not wired into a brain are given
+    # a chance of -1 so that they are never taken
+    def getTriggerChances(self, senses: np.ndarray) -> np.ndarray:
+        triggerChance = (np.tanh(self.getActionValues(senses)) + 1) / 2
+        return np.where(self.hasAction, triggerChance, -1)
+
+    # determine which actions every organism will take, returned as a boolean (organisms x ActionTypes) matrix
+    def determineActions(self, senses: np.ndarray) -> np.ndarray:
+        triggerChances = self.getTriggerChances(senses)
+        return randomStreams.stream(ACTIONS).random(triggerChances.shape) < triggerChances
+
+    # return a batch of just the brains from start up to (but not including) end
+    def shard(self, start: int, end: int) -> 'BrainBatch':
+        shard = copy.copy(self)
+        shard.count = end - start
+        shard.sources = self.sources[start:end]
+        shard.targets = self.targets[start:end]
+        shard.weights = self.weights[start:end]
+        shard.hasAction = self.hasAction[start:end]
+        shard.actionOrder = self.actionOrder[start:end]
+        shard.hasSense = self.hasSense[start:end]
+        return shard
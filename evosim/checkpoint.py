@@ -0,0 +1,122 @@
+import os
+import json
+import numpy as np
+
+from config import Config
+from .grid import Grid
+from .coord import Coord
+from .genome import Genome
+from .organism import Organism
+from .genome_similarity import NFactorGeneticSimilary
+from .rng import randomStreams
+
+CHECKPOINT_FILE = "checkpoint.npz"
+
+# config values that only change how a run is carried out rather than what is simulated, so a resumed run takes them
+# from the command line rather than the checkpoint. Everything else (including the obstacles, which only config.py
+# sets) is saved, so a resumed run simulates the same grid even if config.py has changed since the run started
+EXECUTION_VALUES = [
+    Config.ENGINE, Config.SHARD_WORKERS, Config.BACKGROUND_OUTPUT, Config.OUTPUT_QUEUE_SIZE,
+    Config.CHECKPOINT_INTERVAL, Config.CHECKPOINT_COMPRESSION, Config.TRAJECTORY
+]
+STATS_SERIES = ['survivors', 'similarity', 'survivorAverage', 'similarityAverage', 'similarityFactors']
+
+
+# everything needed to carry on a run from the end of a generation: the survivors (as a packed genome code matrix,
+# along with their ids, locations and, if the mating strategy needs them, similarity factors), the series of stats
+# recorded so far, the state of the random number generators and the config the run was started with. Checkpoints
+# are saved as a single .npz file in the output folder, which is replaced atomically so a run killed while saving
+# still leaves the previous checkpoint behind
+class Checkpoint:
+    def __init__(self, generation: int, survivors: dict, stats: dict, randomState: dict, config: dict):
+        self.generation = generation
+        self.survivors = survivors
+        self.stats = stats
+        self.randomState = randomState
+        self.config = config
+
+    # capture the state at the end of a generation, once its survivors have been chosen
+    @staticmethod
+    def capture(generation: int, survivors: list[Organism], stats) -> 'Checkpoint':
+        # the genetic similarity mating strategy will need the survivors' factors, so they are calculated now (before
+        # the random state is taken, as the next generation would have calculated them first thing)
+        if Config.get(Config.MATING_STRATEGY) == 1:
+            for org in survivors:
+                org.similarity
+
+        factors = np.zeros((0, 0))
+        if survivors and all(org.similarityFactors is not None for org in survivors):
+            factors = np.array([org.similarityFactors.factors for org in survivors], dtype=np.float64)
+
+        return Checkpoint(
+            generation,
+            {
+                'codes': Genome.stack([org.brain.genome for org in survivors]),
+                'ids': np.array([org.id for org in survivors], dtype=np.int64),
+                'x': np.array([org.loc.x for org in survivors], dtype=np.int32),
+                'y': np.array([org.loc.y for org in survivors], dtype=np.int32),
+                'factors': factors
+            },
+            {name: np.asarray(getattr(stats, name)) for name in STATS_SERIES},
+            randomStreams.getState(),
+            {name: value for name, value in Config.configValues.items() if name not in EXECUTION_VALUES}
+        )
+
+    @staticmethod
+    def path(folder: str) -> str:
+        return os.path.join(folder, CHECKPOINT_FILE)
+
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return os.path.exists(Checkpoint.path(folder))
+
+    # write the checkpoint to a temporary file and then move it over the last one
+    def save(self, folder: str, compress: bool = False):
+        arrays = {
+            'generation': np.array(self.generation),
+            **{f'survivor_{name}': values for name, values in self.survivors.items()},
+            **{f'stats_{name}': values for name, values in self.stats.items()},
+            'randomState': np.array(json.dumps(self.randomState)),
+            'config': np.array(json.dumps(self.config))
+        }
+
+        path = Checkpoint.path(folder)
+        tempPath = f"{path}.tmp"
+        with open(tempPath, 'wb') as checkpointFile:
+            (np.savez_compressed if compress else np.savez)(checkpointFile, **arrays)
+            checkpointFile.flush()
+            os.fsync(checkpointFile.fileno())
+        os.replace(tempPath, path)
+
+    @staticmethod
+    def load(folder: str) -> 'Checkpoint':
+        with np.load(Checkpoint.path(folder)) as data:
+            return Checkpoint(
+                int(data['generation']),
+                {name: data[f'survivor_{name}'] for name in ['codes', 'ids', 'x', 'y', 'factors']},
+                {name: data[f'stats_{name}'] for name in STATS_SERIES},
+                json.loads(str(data['randomState'])),
+                json.loads(str(data['config']))
+            )
+
+    def applyConfig(self):
+        Config.configValues.update(self.config)
+
+    def restoreRandomState(self):
+        randomStreams.setState(self.randomState)
+
+    def restoreStats(self, stats):
+        for name in STATS_SERIES:
+            setattr(stats, name, self.stats[name].tolist())
+
+    # recreate the survivors in the given grid, in the locations they finished the generation in
+    def createSurvivors(self, grid: Grid) -> list[Organism]:
+        survivors = []
+        for i, codes in enumerate(self.survivors['codes']):
+            org = Organism(int(self.survivors['ids'][i]), grid, Genome(codes))
+            org.loc = Coord(int(self.survivors['x'][i]), int(self.survivors['y'][i]))
+            if len(self.survivors['factors']):
+                org.similarity = NFactorGeneticSimilary()
+                org.similarity.factors = self.survivors['factors'][i].tolist()
+            survivors.append(org)
+        return survivors
@@ -1,86 +1,167 @@
-import random
+import hashlib
+import numpy as np
 from config import Config
+from .rng import randomStreams, GENOME
 from .node import NodeType, ActionTypes, SenseTypes
 
+GENE_BITS = 24
+
+# decodes gene codes into the values of the connection they describe. Each part of a connection only depends on
+# its own group of bits (7 for the input node, 7 for the output node and 8 for the weight), so instead of working
+# them out for every gene we build small lookup tables for every possible value of each group once. The node ids
+# depend on NUM_INTERNAL_NODES, so the tables are rebuilt whenever that changes
+class GeneDecoder:
+    numInternalNodes = None
+    inputTypes: np.ndarray = None
+    inputIds: np.ndarray = None
+    outputTypes: np.ndarray = None
+    outputIds: np.ndarray = None
+    weights: np.ndarray = None
+    inputTable: list[tuple] = []
+    outputTable: list[tuple] = []
+    weightTable: list[float] = []
+
+    @staticmethod
+    def ensureTables():
+        numInternalNodes = Config.get(Config.NUM_INTERNAL_NODES)
+        if GeneDecoder.numInternalNodes == numInternalNodes:
+            return
+
+        # input bits: the type followed by the 6 bit id
+        inputBits = np.arange(1 << 7)
+        GeneDecoder.inputTypes = np.where(inputBits >> 6 == 0, NodeType.SENSE, NodeType.INNER)
+        GeneDecoder.inputIds = np.where(
+            GeneDecoder.inputTypes == NodeType.SENSE, (inputBits & 0x3F) % SenseTypes.count(), (inputBits & 0x3F) % numInternalNodes
+        )
+
+        # output bits: the type followed by the 6 bit id
+        outputBits = np.arange(1 << 7)
+        GeneDecoder.outputTypes = np.where(outputBits >> 6 == 1, NodeType.INNER, NodeType.ACTION)
+        GeneDecoder.outputIds = np.where(
+            GeneDecoder.outputTypes == NodeType.INNER, (outputBits & 0x3F) % numInternalNodes, (outputBits & 0x3F) % ActionTypes.count()
+        )
+
+        GeneDecoder.weights = np.arange(1 << 8) / 32 - 4
+
+        GeneDecoder.inputTable = list(zip(GeneDecoder.inputTypes.tolist(), GeneDecoder.inputIds.tolist()))
+        GeneDecoder.outputTable = list(zip(GeneDecoder.outputTypes.tolist(), GeneDecoder.outputIds.tolist()))
+        GeneDecoder.weightTable = GeneDecoder.weights.tolist()
+        GeneDecoder.numInternalNodes = numInternalNodes
+
+    # return (inputType, inputId, outputType, outputId, weight) for a single code
+    @staticmethod
+    def decode(code: int) -> tuple:
+        GeneDecoder.ensureTables()
+        return (
+            *GeneDecoder.inputTable[code >> 17],
+            *GeneDecoder.outputTable[(code >> 9) & 0x7F],
+            GeneDecoder.weightTable[code & 0xFF]
+        )
+
+    # the batched equivalent of decode: return arrays of input types, input ids, output types, output ids and weights
+    @staticmethod
+    def decodeMany(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        GeneDecoder.ensureTables()
+        inputBits = codes >> 17
+        outputBits = (codes >> 9) & 0x7F
+        return (
+            GeneDecoder.inputTypes[inputBits],
+            GeneDecoder.inputIds[inputBits],
+            GeneDecoder.outputTypes[outputBits],
+            GeneDecoder.outputIds[outputBits],
+            GeneDecoder.weights[codes & 0xFF]
+        )
+
+
 class Gene:
     # we convert a "code" of 24 bits into a set of integers that will determine the type
-    # of connection that the gene will construct. This code is comprised of the following:
-    #   - inputType: 0 if the output will be an SENSE node, 1 if it will be an INTERNAL node
-    #   - inputId: the id of the input node (we will use a modulo in the brain to make sure it points to a real node)
-    #   - outputType: 0 if the output will be an INNER node, 0 for a ACTION node
-    #   - outputId: the id of the output node (we will also use a modulo here)
-    #   - weight: a float from -4 to 4 that indicates the strength of this connection
-    def __init__(self, code: str):
-        self.code = code
-
-        self.setInputType()
-        self.setOutputType()
-        self.setInputId()
-        self.setOutputId()
-
-        self.weight = (int(code[16:], 2) / 32 - 4)
-
-    def setInputType(self):
-        codeInputType = int(self.code[0], 2)
-        self.inputType = NodeType.SENSE if codeInputType == 0 else NodeType.INNER
-
-    def setOutputType(self):
-        codeOutputType = int(self.code[8], 2)
-        self.outputType = NodeType.INNER if codeOutputType else NodeType.ACTION
-
-    def setInputId(self):
-        codeInputId = int(self.code[1:7], 2)
-        self.inputId = codeInputId % SenseTypes.count() if self.inputType == NodeType.SENSE else codeInputId % Config.get(Config.NUM_INTERNAL_NODES)
-    
-    def setOutputId(self):
-        codeOutputId = int(self.code[9:15], 2)
-        self.outputId = codeOutputId % Config.get(Config.NUM_INTERNAL_NODES) if self.outputType == NodeType.INNER else codeOutputId % ActionTypes.count()
-
-    # for the first generation there are no parents, so we must generate a random bit string
+    # of connection that the gene will construct. Reading the bits from the most significant (bit 0) down, this code is comprised of the following:
+    #   - inputType (bit 0): 0 if the output will be an SENSE node, 1 if it will be an INTERNAL node
+    #   - inputId (bits 1-6): the id of the input node (we will use a modulo in the brain to make sure it points to a real node)
+    #   - outputType (bit 8): 0 if the output will be an INNER node, 0 for a ACTION node
+    #   - outputId (bits 9-14): the id of the output node (we will also use a modulo here)
+    #   - weight (bits 16-23): a float from -4 to 4 that indicates the strength of this connection
+    # see GeneDecoder for how these are looked up
+    def __init__(self, code: int):
+        self.code = int(code)
+        self.inputType, self.inputId, self.outputType, self.outputId, self.weight = GeneDecoder.decode(self.code)
+
+    # the code as a string of 24 binary digits, for display and serialization
+    def codeString(self) -> str:
+        return f'{self.code:0{GENE_BITS}b}'
+
     @staticmethod
-    def gen_random():
-        return Gene(f'{random.getrandbits(24):=024b}')
+    def from_string(code: str):
+        return Gene(int(code, 2))
 
 
-    # creates a new gene based on two parent genes (representated as a string of binary).
-    # we do this by copying one gene and then splicing a random segment from the other gene into the middle. 
-    # After this has been completed we may perform a point mutation on the gene
-    @staticmethod
-    def gen_from_parents(parentGene: 'Gene', parent2Gene: 'Gene'):
-        baseCode = parentGene.code if random.randint(0, 1) == 0 else parent2Gene.code
-        codeToInsert = parentGene.code if baseCode == parent2Gene.code else parent2Gene.code
-
-        startInsertIndex = random.randint(0, len(baseCode))
-        endInsertIndex = random.randint(0, len(baseCode))
-
-        if startInsertIndex > endInsertIndex:
-            startInsertIndex, endInsertIndex = endInsertIndex, startInsertIndex
-        
-        code = baseCode[:startInsertIndex] + codeToInsert[startInsertIndex:endInsertIndex] + baseCode[endInsertIndex:]
-        return Gene(Gene.mutateCode(code))
-    
-    # perform a point mutation on the gene by flipping one bit in the string. We first check whether we should perform
-    # a mutation by generating a random number from 0 to 1 and seeing if it is less than the mutation chance
-    @staticmethod
-    def mutateCode(code: str):
-        if random.random() < Config.get(Config.MUTATE_CHANCE):
-            bitToFlip = random.randint(0, len(code) - 1)
-            code = code[:bitToFlip] + ("1" if code[bitToFlip] == "0" else "0") + code[bitToFlip+1:]
+# a mask with the bits from start up to (but not including) end set, where bit 0 is the most significant of the 24.
+# Works on ints or arrays
+def segmentMask(start, end):
+    return ((1 << (np.asarray(end, dtype=np.int64) - start)) - 1) << (GENE_BITS - np.asarray(end, dtype=np.int64))
+
+# copy the base code(s) and splice in the bits from start to end of the code(s) to insert. Works on ints or arrays
+def crossoverCodes(base, insert, start, end):
+    mask = segmentMask(start, end)
+    result = (np.asarray(base, dtype=np.int64) & ~mask) | (np.asarray(insert, dtype=np.int64) & mask)
+    return int(result) if result.ndim == 0 else result.astype(np.uint32)
 
-        return code
+# flip a single bit of the code(s), where bit 0 is the most significant of the 24. Works on ints or arrays
+def flipBits(code, bit):
+    result = np.asarray(code, dtype=np.int64) ^ (1 << (GENE_BITS - 1 - np.asarray(bit, dtype=np.int64)))
+    return int(result) if result.ndim == 0 else result.astype(np.uint32)
 
 
+# a genome is stored as an array of packed 24 bit gene codes (one uint32 per gene). The genomes of a whole
+# generation are usually rows of a single (organisms x genes) matrix, so each Genome is a view into it. The codes
+# are never changed once a genome is created, so a hash of them identifies genomes with the same content
 class Genome:
-    def __init__(self, genes: list[Gene]):
-        self.genes = genes
+    def __init__(self, codes: np.ndarray):
+        self.codes = codes
+        self.genes = [Gene(code) for code in codes.tolist()]
+        self.hash = hashlib.blake2b(np.ascontiguousarray(codes, dtype=np.uint32).tobytes(), digest_size=16).digest()
 
+    # create the genomes for a whole generation as the rows of one random code matrix
     @staticmethod
-    def gen_random():    
-        return Genome([Gene.gen_random() for _ in range(Config.get(Config.GENES))])
+    def gen_random_generation(count: int) -> list['Genome']:
+        return [Genome(codes) for codes in Genome.gen_random_codes(count)]
+
+    @staticmethod
+    def gen_random_codes(count: int) -> np.ndarray:
+        return randomStreams.stream(GENOME).integers(0, 1 << GENE_BITS, size=(count, Config.get(Config.GENES)), dtype=np.uint32)
+
+    # create the genomes for a whole generation at once, given the parents' codes as a (parents x genes) matrix
+    # and a (children x 2) array of the indices of each child's parents in it
+    @staticmethod
+    def gen_generation_from_parents(parentCodes: np.ndarray, parentPairs: np.ndarray) -> list['Genome']:
+        return [Genome(codes) for codes in Genome.reproduceCodes(parentCodes, parentPairs)]
+
+    # create the codes of every gene of every child. Each gene is made by copying the gene at the same position in
+    # one parent and splicing a random segment from the other parent's gene into the middle, after which a single bit
+    # may be flipped as a point mutation. Each stage (choosing which parent is the base, choosing the segment to splice
+    # in, and mutating) is a single random draw for the whole generation
+    @staticmethod
+    def reproduceCodes(parentCodes: np.ndarray, parentPairs: np.ndarray) -> np.ndarray:
+        firstParentCodes = parentCodes[parentPairs[:, 0]]
+        secondParentCodes = parentCodes[parentPairs[:, 1]]
+        shape = firstParentCodes.shape
+
+        generator = randomStreams.stream(GENOME)
+        useFirstAsBase = generator.integers(0, 2, size=shape) == 0
+        baseCodes = np.where(useFirstAsBase, firstParentCodes, secondParentCodes)
+        codesToInsert = np.where(useFirstAsBase, secondParentCodes, firstParentCodes)
+
+        insertIndices = np.sort(generator.integers(0, GENE_BITS + 1, size=(*shape, 2)), axis=-1)
+        codes = crossoverCodes(baseCodes, codesToInsert, insertIndices[..., 0], insertIndices[..., 1])
+
+        mutate = generator.random(shape) < Config.get(Config.MUTATE_CHANCE)
+        bitsToFlip = generator.integers(0, GENE_BITS, size=shape)
+        codes[mutate] = flipBits(codes[mutate], bitsToFlip[mutate])
+        return codes
 
+    # stack the codes of several genomes into one (genomes x genes) matrix
     @staticmethod
-    def gen_from_parents(parentGenome: 'Genome', parent2Genome: 'Genome'):
-        return Genome([
-            Gene.gen_from_parents(parentGene, parent2Gene) 
-            for parentGene, parent2Gene in zip(parentGenome.genes, parent2Genome.genes)
-        ])
+    def stack(genomes: list['Genome']) -> np.ndarray:
+        if not genomes:
+            return np.zeros((0, Config.get(Config.GENES)), dtype=np.uint32)
+        return np.stack([genome.codes for genome in genomes])
@@ -1,17 +1,76 @@
-import random
 import math
 import numpy as np
+from collections import OrderedDict
+from scipy import sparse
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .organism import Organism
 
-from .genome import Gene, Genome
+from config import Config
+from .genome import Gene, Genome, GeneDecoder, GENE_BITS
+from .node import NodeType, SenseTypes, ActionTypes
+from .rng import randomStreams, SIMILARITY
+
+# how many genome pairs the batched similarity kernel compares at once. Each pair needs a (genes x genes) block
+# of scores, so this bounds the memory used when comparing large populations
+SIMILARITY_CHUNK_SIZE = 2048
+
+# organisms at least this similar to each other are considered to be in the same group when coloring a generation
+GROUP_SIMILARITY = .9
+# the number of bits set in every possible byte
+BYTE_BIT_COUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.int64)
+
+COLOR_OPTIONS = ['#e6194B', '#3cb44b', '#ffe119', '#4363d8', '#f58231', '#42d4f4', '#f032e6', '#fabed4', '#469990', '#dcbeff', '#9A6324', '#fffac8', '#800000', '#aaffc3', '#000075', '#a9a9a9']
+
+# remembers the similarity of genome pairs by the hashes of their contents. Once a population starts to converge most
+# of its genomes are copies (or near copies) of each other, so the same pairs come up generation after generation.
+# The pair key is ordered so that it doesn't matter which genome is given first, and the least recently used pairs are
+# dropped once there are more than SIMILARITY_CACHE_SIZE of them
+class SimilarityCache:
+    def __init__(self):
+        self.similarities: OrderedDict[tuple[bytes, bytes], float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.similarities)
+
+    @staticmethod
+    def key(genome: Genome, genome2: Genome) -> tuple[bytes, bytes]:
+        return (genome.hash, genome2.hash) if genome.hash <= genome2.hash else (genome2.hash, genome.hash)
+
+    def get(self, key: tuple[bytes, bytes]) -> float | None:
+        similarity = self.similarities.get(key)
+        if similarity is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.similarities.move_to_end(key)
+        return similarity
+
+    def put(self, key: tuple[bytes, bytes], similarity: float):
+        self.similarities[key] = similarity
+        self.similarities.move_to_end(key)
+        while len(self.similarities) > Config.get(Config.SIMILARITY_CACHE_SIZE):
+            self.similarities.popitem(last=False)
+
+    def clear(self):
+        self.similarities.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hitRate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+similarityCache = SimilarityCache()
+
 
 class NFactorGeneticSimilary:
     def __init__(self):
         self.factors = []
-        self.colorCode = '#000000'
 
     def totalSimilarity(self):
         return sum(self.factors)
@@ -29,24 +88,45 @@ class NFactorGeneticSimilary:
         return difference
 
 
+# the similarity factors of a generation (see calcGenerationSimiarity). They are only needed by some mating strategies
+# and output, so rather than calculating them for every generation they are calculated the first time one of the
+# organisms is asked for its factors, and then kept for the rest of the generation
+class GenerationSimilarity:
+    def __init__(self, organisms: list['Organism'], numFactors: int):
+        self.organisms = organisms
+        self.numFactors = numFactors
+        self.calculated = False
+
+        for org in organisms:
+            org.generationSimilarity = self
+
+    def calculate(self):
+        if not self.calculated:
+            self.calculated = True
+            calcGenerationSimiarity(self.organisms, self.numFactors)
+
+
 # this assigns each organism a color based upon its similarity to other organisms. If an organism is part of a group where all of the members are at least 90% genetically
 # similar to a particular "center organism", then that group will get its own color. All other organisms will be colored black by default.
+# Groups are always found with the weighted similarity, whichever metric is configured
 def calcGenerationColors(organisms: list['Organism']):
-    colorOptions = ['#e6194B', '#3cb44b', '#ffe119', '#4363d8', '#f58231', '#42d4f4', '#f032e6', '#fabed4', '#469990', '#dcbeff', '#9A6324', '#fffac8', '#800000', '#aaffc3', '#000075', '#a9a9a9']
-    similarityFactors = np.zeros((len(organisms), len(organisms)))
+    if Config.get(Config.COLOR_CLUSTERING) == "graph":
+        calcGenerationColorsGraph(organisms)
+    else:
+        calcGenerationColorsDense(organisms)
 
-    # compute the similarity of all organisms against all others. This seems like a lot but actually is not very computationally expensive
-    for i in range(len(organisms)):
-        for j in range(i + 1, len(organisms)):
-            similarity = genomeSimilarity(organisms[i].brain.genome, organisms[j].brain.genome)
-            similarityFactors[i][j] = similarity
-            similarityFactors[j][i] = similarity
+def calcGenerationColorsDense(organisms: list['Organism']):
+    colorOptions = COLOR_OPTIONS
+
+    # compute the similarity of all organisms against all others. An organism is not counted as similar to itself
+    similarityFactors = genomeSimilarityMatrix([org.brain.genome for org in organisms])
+    np.fill_diagonal(similarityFactors, 0)
 
     groupedSimilaritiesMap = {}
 
     # organisms will be considered "in a group" if they are 90% similar to each other, so for each organism get a listing
     # of all the organisms that are at least 90% simmilar 
-    indicies = np.where(similarityFactors > .9)
+    indicies = np.where(similarityFactors > GROUP_SIMILARITY)
 
     for centerIndex, orgIndex in zip(indicies[0], indicies[1]):
         if not centerIndex in groupedSimilaritiesMap:
@@ -67,7 +147,7 @@ def calcGenerationColors(organisms: list['Organism']):
     groupNum = 0
     while largestGroup is not None and groupNum < len(colorOptions):
         for index in largestGroup['orgs']:
-            organisms[index].similarity.colorCode = colorOptions[groupNum]
+            organisms[index].colorCode = colorOptions[groupNum]
 
             # remove all other groups that have one of the organisms in this group at the center
             if index in groupedSimilaritiesMap:
@@ -88,6 +168,115 @@ def calcGenerationColors(organisms: list['Organism']):
         # groups set largestGroup to None and exit the group coloring loop
         largestGroup = newLargestGroup if newLargestGroup and len(newLargestGroup['orgs']) > 2 else None
 
+# the same grouping as calcGenerationColorsDense, without comparing every pair of organisms. Organisms with the same
+# genome always end up in the same groups, so the groups are found between the distinct genomes (weighted by how many
+# organisms share each one) using a sparse graph that only links genomes that are similar enough to share a group.
+# The group around a genome then has (copies of it) + (copies of its neighbours) members, and peeling off the largest
+# group is a sparse matrix product instead of a rescan of every group
+def calcGenerationColorsGraph(organisms: list['Organism']):
+    uniqueGenomes, inverse = uniqueByContent([org.brain.genome for org in organisms])
+    remaining = np.bincount(inverse, minlength=len(uniqueGenomes))
+    neighbours = similarGenomeGraph(uniqueGenomes)
+
+    # an organism is at the center of a group if it is similar to at least one other organism
+    hasGroup = (remaining > 1) | (np.diff(neighbours.indptr) > 0)
+    colors = np.full(len(uniqueGenomes), -1)
+
+    groupNum = 0
+    while groupNum < len(COLOR_OPTIONS):
+        # a group is removed once its center has been colored. Ties go to the genome that appears first
+        sizes = np.where(hasGroup & (remaining > 0), remaining + neighbours @ remaining, 0)
+        center = np.argmax(sizes)
+
+        # a group must have at least 3 members to get their own color (the first group is always colored)
+        if sizes[center] == 0 or (groupNum > 0 and sizes[center] <= 2):
+            break
+
+        members = np.append(neighbours.indices[neighbours.indptr[center]:neighbours.indptr[center + 1]], center)
+        members = members[remaining[members] > 0]
+        colors[members] = groupNum
+        remaining[members] = 0
+        groupNum += 1
+
+    for org, color in zip(organisms, colors[inverse].tolist()):
+        if color >= 0:
+            org.colorCode = COLOR_OPTIONS[color]
+
+# return a symmetric sparse (genomes x genomes) matrix linking every pair of distinct genomes that are more than
+# GROUP_SIMILARITY similar. Comparing genes that don't connect the same input and output nodes scores at most .75 and
+# genes that do at most .95, so to be more than .9 similar over 3/4 of the genes must share their connection with a
+# gene in the other genome. If two genomes share at least that many connections, then they must also share at least
+# one of the (genes - shared + 1) rarest connections of each genome, so only genomes that do are actually compared
+def similarGenomeGraph(genomes: list[Genome]) -> sparse.csr_matrix:
+    if len(genomes) < 2:
+        return sparse.csr_matrix((len(genomes), len(genomes)), dtype=np.int64)
+
+    connections = connectionTokens(genomes)
+    numGenes = connections.shape[1]
+    minShared = math.floor(numGenes * 3 / 4) + 1
+
+    # sort each genome's connections from the rarest in the generation to the most common, and keep the first few
+    frequency = np.bincount(connections.ravel())
+    order = np.lexsort((connections, frequency[connections]), axis=1)
+    prefixes = np.take_along_axis(connections, order, axis=1)[:, :numGenes - minShared + 1]
+
+    first, second = pairsSharingConnections(prefixes)
+    possible = countSharedConnections(connections, first, second) >= minShared
+    first = first[possible]
+    second = second[possible]
+
+    similar = pairSimilarities(genomes, first, second, useCache=False) > GROUP_SIMILARITY
+    first = first[similar]
+    second = second[similar]
+    return sparse.csr_matrix(
+        (np.ones(2 * len(first), dtype=np.int64), (np.concatenate([first, second]), np.concatenate([second, first]))),
+        shape=(len(genomes), len(genomes))
+    )
+
+# return a (genomes x genes) matrix identifying the connection each gene makes. A genome can have several genes making
+# the same connection, so each repeat is numbered to keep them distinct (only the first repeat in one genome can be
+# matched with the first repeat in another, and so on)
+def connectionTokens(genomes: list[Genome]) -> np.ndarray:
+    numInternalNodes = Config.get(Config.NUM_INTERNAL_NODES)
+    inputType, inputId, outputType, outputId, _ = GeneDecoder.decodeMany(Genome.stack(genomes))
+
+    inputIndex = np.where(inputType == NodeType.SENSE, inputId, SenseTypes.count() + inputId)
+    outputIndex = np.where(outputType == NodeType.INNER, outputId, numInternalNodes + outputId)
+    connections = np.sort(inputIndex * (numInternalNodes + ActionTypes.count()) + outputIndex, axis=1)
+
+    numGenes = connections.shape[1]
+    repeatStarts = np.maximum.accumulate(
+        np.where(np.diff(connections, axis=1, prepend=-1) != 0, np.arange(numGenes), 0), axis=1
+    )
+    return connections * numGenes + (np.arange(numGenes) - repeatStarts)
+
+# return how many connections each pair of genomes (given by two arrays of indices) share
+def countSharedConnections(connections: np.ndarray, first: np.ndarray, second: np.ndarray, chunkSize: int = 32 * SIMILARITY_CHUNK_SIZE) -> np.ndarray:
+    shared = np.empty(len(first), dtype=np.int64)
+    for start in range(0, len(first), chunkSize):
+        chunk = slice(start, start + chunkSize)
+        shared[chunk] = (connections[first[chunk], :, None] == connections[second[chunk], None, :]).sum(axis=(1, 2))
+    return shared
+
+# return the indices (first < second) of every pair of rows in a (genomes x tokens) matrix that share a token
+def pairsSharingConnections(tokens: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    rows = np.repeat(np.arange(len(tokens)), tokens.shape[1])
+    order = np.lexsort((rows, tokens.ravel()))
+    sortedTokens = tokens.ravel()[order]
+    sortedRows = rows[order]
+
+    # pair each row with every row after it in the same group of equal tokens (a row never has the same token twice)
+    groupStarts = np.flatnonzero(np.diff(sortedTokens, prepend=-1) != 0)
+    groupEnds = np.append(groupStarts[1:], len(sortedTokens))
+    laterCounts = np.repeat(groupEnds, groupEnds - groupStarts) - np.arange(len(sortedTokens)) - 1
+    firstPositions = np.repeat(np.arange(len(sortedTokens)), laterCounts)
+    secondPositions = firstPositions + 1 + np.arange(len(firstPositions)) - np.repeat(np.cumsum(laterCounts) - laterCounts, laterCounts)
+
+    # a pair can share more than one token
+    pairs = np.sort(sortedRows[firstPositions].astype(np.int64) * len(tokens) + sortedRows[secondPositions])
+    pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+    return pairs // len(tokens), pairs % len(tokens)
+
 # determine the genetic similarity of a list of organisms. A comprehensive method
 # would require comparing every organism to every other one, which is far too expensive,
 # so instead we do 'numFactors' number of comparisons for each. This is accomplished by picking 
@@ -98,20 +287,16 @@ def calcGenerationSimiarity(organisms: list['Organism'], numFactors: int):
     for org in organisms:
         org.similarity = NFactorGeneticSimilary()
 
-    benchmark = organisms[random.randint(0, len(organisms) - 1)]
+    genomes = [org.brain.genome for org in organisms]
+    benchmark = organisms[randomStreams.stream(SIMILARITY).integers(len(organisms))]
     for _ in range(numFactors):
-        similarityMap = {}
-
-        minSimilarity = 1
-        for org in organisms:
-            similarity = genomeSimilarity(benchmark.brain.genome, org.brain.genome)
-            similarityMap[org.id] = similarity
-            
-            minSimilarity = min(minSimilarity, similarity)
+        similarities = genomeSimilarityOneToMany(benchmark.brain.genome, genomes)
+        minSimilarity = min(1, similarities.min())
   
         newBenchmark: Organism = organisms[0]
-        for org in organisms:
-            similarity = math.floor((similarityMap[org.id] - minSimilarity) / (1 - minSimilarity) * 100)
+        for org, similarity in zip(organisms, similarities.tolist()):
+            # if every genome is the same as the benchmark (ex: a generation that has converged), they all score 100
+            similarity = math.floor((similarity - minSimilarity) / (1 - minSimilarity) * 100) if minSimilarity < 1 else 100
             org.similarity.addSimilarityFactor(similarity)
             if org.similarity.totalSimilarity() < newBenchmark.similarity.totalSimilarity():
                 newBenchmark = org
@@ -119,13 +304,159 @@ def calcGenerationSimiarity(organisms: list['Organism'], numFactors: int):
         benchmark = newBenchmark
 
 
-# return the average similarity of the genes in two genomes. Currently we just compare the xth gene from the first
-# genome to the xth gene from the second genome as sexual reproduction always is between those genes, but this will
-# need to be adjusted if gene duplication/irregular gene lengths is added
+# the batched equivalent of genomeSimilarity: return the similarity of one genome to each of a list of genomes
+def genomeSimilarityOneToMany(genome: Genome, genomes: list[Genome]) -> np.ndarray:
+    if Config.get(Config.SIMILARITY_METRIC) == "hamming":
+        return codesHammingSimilarity(genome.codes, Genome.stack(genomes))
+
+    uniqueGenomes, inverse = uniqueByContent(genomes)
+    similarities = pairSimilarities(
+        [*uniqueGenomes, genome], np.full(len(uniqueGenomes), len(uniqueGenomes)), np.arange(len(uniqueGenomes))
+    )
+    return similarities[inverse]
+
+# return the (genomes x genomes) matrix of the weighted similarity of every genome to every other. Genomes with the
+# same content are only compared once, and each pair of distinct genomes is only compared once
+def genomeSimilarityMatrix(genomes: list[Genome]) -> np.ndarray:
+    uniqueGenomes, inverse = uniqueByContent(genomes)
+    similarities = np.ones((len(uniqueGenomes), len(uniqueGenomes)))
+
+    firstIndices, secondIndices = np.triu_indices(len(uniqueGenomes), k=1)
+    pairs = pairSimilarities(uniqueGenomes, firstIndices, secondIndices, useCache=False)
+    similarities[firstIndices, secondIndices] = pairs
+    similarities[secondIndices, firstIndices] = pairs
+    return similarities[np.ix_(inverse, inverse)]
+
+# return the genomes with distinct contents (in the order they first appear) and the index of each genome among them
+def uniqueByContent(genomes: list[Genome]) -> tuple[list[Genome], np.ndarray]:
+    uniqueIndices = {}
+    uniqueGenomes = []
+    inverse = np.empty(len(genomes), dtype=np.int64)
+    for i, genome in enumerate(genomes):
+        index = uniqueIndices.get(genome.hash)
+        if index is None:
+            index = uniqueIndices[genome.hash] = len(uniqueGenomes)
+            uniqueGenomes.append(genome)
+        inverse[i] = index
+    return uniqueGenomes, inverse
+
+# return the similarity of each pair of genomes given by two arrays of indices into a list of genomes. The pairs are
+# compared with the batched kernel in chunks (so that the memory used stays bounded for large populations). With
+# useCache, pairs are looked up in the similarity cache first and the rest are added to it, but only when there are
+# few enough of them that they wouldn't push out most of what the cache holds (the colouring compares so many pairs
+# that it never finds them in the cache, so doesn't use it at all)
+def pairSimilarities(
+    genomes: list[Genome], firstIndices: np.ndarray, secondIndices: np.ndarray, chunkSize: int = SIMILARITY_CHUNK_SIZE, useCache: bool = True
+) -> np.ndarray:
+    # rank the genomes by hash, so that every pair can be put in the order of its cache key (genomeSimilarity isn't
+    # quite symmetric, so pairs are always compared in that order) and identical genomes found without a python loop
+    _, ranks = np.unique(np.array([genome.hash for genome in genomes], dtype='S16'), return_inverse=True)
+    ranks = ranks.ravel()
+    swap = ranks[firstIndices] > ranks[secondIndices]
+    orderedFirst = np.where(swap, secondIndices, firstIndices)
+    orderedSecond = np.where(swap, firstIndices, secondIndices)
+
+    similarities = np.ones(len(firstIndices))
+    missing = np.flatnonzero(ranks[orderedFirst] != ranks[orderedSecond])
+
+    useCache = useCache and len(missing) <= Config.get(Config.SIMILARITY_CACHE_SIZE) // 10
+    missingKeys = []
+    if useCache:
+        hashes = [genome.hash for genome in genomes]
+        keys = [(hashes[first], hashes[second]) for first, second in zip(orderedFirst[missing].tolist(), orderedSecond[missing].tolist())]
+        cached = [similarityCache.get(key) for key in keys]
+        found = np.array([similarity is not None for similarity in cached], dtype=bool)
+        similarities[missing[found]] = [similarity for similarity in cached if similarity is not None]
+        missingKeys = [key for key, similarity in zip(keys, cached) if similarity is None]
+        missing = missing[~found]
+
+    codes = Genome.stack(genomes)
+    for start in range(0, len(missing), chunkSize):
+        chunk = missing[start:start + chunkSize]
+        similarities[chunk] = codesSimilarity(codes[orderedFirst[chunk]], codes[orderedSecond[chunk]])
+
+    for key, similarity in zip(missingKeys, similarities[missing].tolist()):
+        similarityCache.put(key, similarity)
+    return similarities
+
+def orderedPair(genome: Genome, genome2: Genome) -> tuple[Genome, Genome]:
+    return (genome, genome2) if genome.hash <= genome2.hash else (genome2, genome)
+
+# a cheap alternative to the weighted similarity: the fraction of bits that are the same in each gene code and the
+# code at the same position in the other genome (as sexual reproduction is always between those genes). Works on
+# any code arrays that broadcast together, comparing along the last (genes) axis
+def codesHammingSimilarity(codes: np.ndarray, codes2: np.ndarray) -> np.ndarray:
+    differentBits = countBits(np.bitwise_xor(codes, codes2)).sum(axis=-1)
+    return 1 - differentBits / (np.shape(codes)[-1] * GENE_BITS)
+
+# the number of bits set in each 24 bit code
+def countBits(codes: np.ndarray) -> np.ndarray:
+    return BYTE_BIT_COUNTS[codes & 0xFF] + BYTE_BIT_COUNTS[(codes >> 8) & 0xFF] + BYTE_BIT_COUNTS[(codes >> 16) & 0xFF]
+
+# compare each row of one (pairs x genes) code matrix with the same row of another, giving the same result as
+# computeGenomeSimilarity for each pair: every gene in the first genome is greedily matched, in order, to the most similar
+# gene in the second genome that hasn't already been matched
+def codesSimilarity(codes: np.ndarray, codes2: np.ndarray) -> np.ndarray:
+    scores = codesGeneSimilarity(codes, codes2)
+    numPairs, numGenes, numGenes2 = scores.shape
+    rows = np.arange(numPairs)
+
+    totalSimilarity = np.zeros(numPairs)
+    for geneIndex in range(numGenes):
+        geneScores = scores[:, geneIndex, :]
+        mostSimilar = np.argmax(geneScores, axis=1)
+        totalSimilarity += geneScores[rows, mostSimilar]
+        # remove the matched gene from the ones still available
+        scores[rows, :, mostSimilar] = -np.inf
+
+    return totalSimilarity / numGenes
+
+# the batched equivalent of geneSimilarity: return a (pairs x genes x genes2) array of the similarity of every gene
+# of each genome in the first code matrix to every gene of the genome in the same row of the second. The score is
+# built up in the same order as geneSimilarity so the results are identical
+def codesGeneSimilarity(codes: np.ndarray, codes2: np.ndarray) -> np.ndarray:
+    inputType, inputId, outputType, outputId, weight = [field[:, :, None] for field in GeneDecoder.decodeMany(codes)]
+    inputType2, inputId2, outputType2, outputId2, weight2 = [field[:, None, :] for field in GeneDecoder.decodeMany(codes2)]
+
+    score = np.zeros((len(codes), codes.shape[1], codes2.shape[1]))
+
+    sameInputType = inputType == inputType2
+    inputIdDifference = np.abs(inputId - inputId2)
+    score = np.where(sameInputType, score + .15, score)
+    score = np.where(sameInputType & (inputIdDifference == 0), score + .3, score)
+    score = np.where(sameInputType & (inputIdDifference == 1), score + .1, score)
+
+    sameOutputType = outputType == outputType2
+    outputIdDifference = np.abs(outputId - outputId2)
+    score = np.where(sameOutputType, score + .15, score)
+    score = np.where(sameOutputType & (outputIdDifference == 0), score + .3, score)
+    # geneSimilarity gives .1 for any difference in output ids, not only a difference of one
+    score = np.where(sameOutputType & (outputIdDifference != 0), score + .1, score)
+
+    # the weight sign check in geneSimilarity (a chained comparison) is never true, so only the closeness of the weights counts
+    score = score + (1 - np.abs(weight - weight2) / 8) * .05
+    return score
+
+# return the similarity of two genomes with the configured metric. Weighted similarities go through the similarity
+# cache. Genomes with the same content are always completely similar
 def genomeSimilarity(genome: Genome, genome2: Genome) -> float:
-    if genome == genome2:
+    if genome.hash == genome2.hash:
         return 1
 
+    if Config.get(Config.SIMILARITY_METRIC) == "hamming":
+        return float(codesHammingSimilarity(genome.codes, genome2.codes))
+
+    key = SimilarityCache.key(genome, genome2)
+    similarity = similarityCache.get(key)
+    if similarity is None:
+        similarity = computeGenomeSimilarity(*orderedPair(genome, genome2))
+        similarityCache.put(key, similarity)
+    return similarity
+
+# return the average similarity of the genes in two genomes. Currently we just compare the xth gene from the first
+# genome to the xth gene from the second genome as sexual reproduction always is between those genes, but this will
+# need to be adjusted if gene duplication/irregular gene lengths is added
+def computeGenomeSimilarity(genome: Genome, genome2: Genome) -> float:
     availableMatches = [*genome2.genes]
     totalSimilarity = 0
     for gene in genome.genes:
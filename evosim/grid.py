@@ -1,128 +1,176 @@
-import random
+import numpy as np
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .organism import Organism
 
-from .node import ActionTypes
+from config import Config
+from .node import ActionTypes, SenseTypes
 from .coord import Coord
 from .obstacle import Obstacle
+from .grid_index import DensityIndex, OccupiedLineIndex
+from .sense_field import SenseField
+from .rng import randomStreams, GRID
+
+# unit steps for each of the four simple move directions, indexed by ActionTypes id
+DIR_X = np.array([1, -1, 0, 0])
+DIR_Y = np.array([0, 0, 1, -1])
+
+# the senses answered by each of the grid's indexes
+DENSITY_SENSES = [SenseTypes.POPULATION_CLOSE, SenseTypes.POPULATION_FORWARD]
+OCCUPIED_SENSES = [SenseTypes.DISTANCE_FROM_FORWARD_ORGANISM, SenseTypes.DISTANCE_FROM_LR_ORGANISM]
 
 class Grid:
     def __init__(self, width: int, height: int, obstacles: list[dict[str, int]]):
         self.width = width
         self.height = height
         self.organisms: list[Organism] = []
-        self.organismLocs: dict[str, Organism] = {}
 
         self.obstacles = [Obstacle(obs[0], obs[1], obs[2], obs[3]) for obs in obstacles]
 
-        # this creates a map of every space on the grid blocked by an obstacle. While this is an expensive call,
-        # checking a location is valid for a move happens around NUM_ORGANISMS * NUM_STEPS * NUM_GENERATIONS times,
-        # so ensuring a fast lookup there is more important
-        self.blockedLocs = {}
+        # the grid is stored as two arrays indexed by [x, y]: the index (into self.organisms) of the organism in
+        # each space, or -1 if it is empty, and a mask of every space blocked by an obstacle. Checking a location
+        # is valid for a move happens around NUM_ORGANISMS * NUM_STEPS * NUM_GENERATIONS times, so these need
+        # to be plain integer lookups
+        self.occupancy = np.full((width, height), -1, dtype=np.int32)
+        self.blocked = np.zeros((width, height), dtype=bool)
         for obs in self.obstacles:
-            for loc in obs.getBlockedSpaces():
-                self.blockedLocs[loc.mapString()] = True
-
+            self.blocked[max(obs.left, 0):obs.right + 1, max(obs.top, 0):obs.bottom + 1] = True
+
+        # obstacles never move, so the distance from every space to the nearest obstacle in each direction
+        # (as returned by getBoundaryDistance) can be worked out once up front
+        self.boundaryDistance = Config.get(Config.SENSE_DISTANCE)
+        self.boundaryDistances = self.computeBoundaryDistances(self.boundaryDistance)
+
+        self.senseField = SenseField(self)
+        self.densityIndex = DensityIndex(width, height)
+        self.occupiedIndex = OccupiedLineIndex(width, height)
+        # whether the occupied line index needs rebuilding before it can be used (see stepStarted)
+        self.occupiedIndexStale = True
+        self.age = 0
+
+    # return a (4 x width x height) array holding, for each simple move direction, the distance from each space
+    # to the nearest obstacle in that direction as a fraction of the max distance (1 if there isn't one within it)
+    def computeBoundaryDistances(self, maxDistance: int) -> np.ndarray:
+        distances = np.ones((4, self.width, self.height))
+        for dir in range(4):
+            # go from the furthest offset to the closest so that the closest obstacle is the one that is kept
+            for i in reversed(range(maxDistance)):
+                offsetX = DIR_X[dir] * (i + 1)
+                offsetY = DIR_Y[dir] * (i + 1)
+                # there are no spaces that far away across the grid, so nothing to hit
+                if abs(offsetX) >= self.width or abs(offsetY) >= self.height:
+                    continue
+
+                hit = np.zeros((self.width, self.height), dtype=bool)
+                hit[max(0, -offsetX):self.width - max(0, offsetX), max(0, -offsetY):self.height - max(0, offsetY)] = \
+                    self.blocked[max(0, offsetX):self.width - max(0, -offsetX), max(0, offsetY):self.height - max(0, -offsetY)]
+                distances[dir][hit] = i / maxDistance
+        return distances
+
+    # place the new generation of organisms into random, distinct, unblocked spaces
     def initGeneration(self, organisms: list['Organism']):
         self.organisms = organisms
-        self.organismLocs = {}
-
-        for organism in self.organisms:
-            proposedLoc = Coord(
-                random.randint(0, self.width - 1), 
-                random.randint(0, self.height - 1)
-            )
-            proposedMapString = proposedLoc.mapString()
-
-            # generate locations randomly until we come across one that is not occupied
-            # it is possible that this could become extremely expensive or even loop forever,
-            # but as long as there is a relatively low population density we shouldn't expect
-            # many repeat locations
-            while proposedMapString in self.organismLocs or proposedMapString in self.blockedLocs:
-                proposedLoc = Coord(
-                    random.randint(0, self.width - 1), 
-                    random.randint(0, self.height - 1)
-                )
-                proposedMapString = proposedLoc.mapString()
-            
-            organism.loc = proposedLoc
-            self.organismLocs[proposedMapString] = organism
+        self.occupancy.fill(-1)
+
+        openSpaces = np.flatnonzero(~self.blocked)
+        if len(organisms) > len(openSpaces):
+            raise ValueError(f"cannot place {len(organisms)} organisms in {len(openSpaces)} open spaces")
+
+        spaces = openSpaces[randomStreams.stream(GRID).choice(len(openSpaces), len(organisms), replace=False)]
+        xs, ys = np.divmod(spaces, self.height)
+        self.occupancy[xs, ys] = np.arange(len(organisms), dtype=np.int32)
+
+        for organism, x, y in zip(self.organisms, xs.tolist(), ys.tolist()):
+            organism.loc = Coord(x, y)
+
+        self.age = 0
+        self.occupiedIndexStale = True
+
+    # update the senses shared by the whole population and rebuild the indexes used by the population senses that
+    # are in usedSenses (the senses the generation's brains are wired to). This is done once at the start of every
+    # step, so all organisms sense the density of the population as it was before anybody moved in that step. The
+    # occupied line index is kept up to date as organisms move one at a time, so it is only rebuilt once a batch of
+    # moves (or a new generation) has left it out of date
+    def stepStarted(self, usedSenses: list[int]):
+        self.age += 1
+        self.senseField.setAge(self.age)
+        if any(senseId in usedSenses for senseId in DENSITY_SENSES):
+            self.densityIndex.rebuild(self.occupancy)
+        if self.occupiedIndexStale and any(senseId in usedSenses for senseId in OCCUPIED_SENSES):
+            self.occupiedIndex.rebuild(self.occupancy)
+            self.occupiedIndexStale = False
 
     def updateLoc(self, org: 'Organism', loc: Coord):
-        del self.organismLocs[org.loc.mapString()]
+        index = self.occupancy[org.loc.x, org.loc.y]
+        self.occupancy[org.loc.x, org.loc.y] = -1
+        if not self.occupiedIndexStale:
+            self.occupiedIndex.move(org.loc.x, org.loc.y, loc.x, loc.y)
         org.loc = loc
-        self.organismLocs[loc.mapString()] = org
+        self.occupancy[loc.x, loc.y] = index
+
+    # move a batch of organisms (given by their index) at once. The destinations must all be available
+    def moveOrganisms(self, indices: np.ndarray, fromX: np.ndarray, fromY: np.ndarray, toX: np.ndarray, toY: np.ndarray):
+        self.occupancy[fromX, fromY] = -1
+        self.occupancy[toX, toY] = indices
+        self.occupiedIndexStale = True
+
+    def inBounds(self, x: int, y: int) -> bool:
+        return x >= 0 and x < self.width and y >= 0 and y < self.height
 
     def locIsAvailable(self, loc: Coord) -> bool:
-        if (loc.x < 0 or loc.x >= self.width or loc.y < 0 or loc.y >= self.height):
+        if not self.inBounds(loc.x, loc.y):
             return False
-        mapStr = loc.mapString()
-        return not mapStr in self.organismLocs and not mapStr in self.blockedLocs
+        return self.occupancy[loc.x, loc.y] < 0 and not self.blocked[loc.x, loc.y]
     
     # given a location and a distance, return the density of organisms within that distance.
-    def getDensityWithinDistance(self, loc: Coord, distance: int) -> bool:
-        condition = lambda org: abs(loc.x - org.loc.x) + abs(loc.y - org.loc.y) <= distance
-        return self.getDensity(condition, 100)
+    def getDensityWithinDistance(self, loc: Coord, distance: int) -> float:
+        return self.densityIndex.countWithinDistance(loc.x, loc.y, distance) / 100
     
     # return the density of organisms in a cone in front of an organism. The "front" is determined
-    # by the last most that organism took.
-    def getDensityWithinDistanceDirected(self, loc: Coord, distance: int, dir: ActionTypes):
-        check = lambda _: False
-
-        if dir == ActionTypes.MOVE_NEG_X:
-            newX = loc.x - distance
-            newLoc = Coord(newX, loc.y)
-            check = lambda org: org.loc.x >= newX and abs(newLoc.x - org.loc.x) + abs(newLoc.y - org.loc.y) <= distance
-
-        elif dir == ActionTypes.MOVE_POS_X:
-            newX = loc.x + distance
-            newLoc = Coord(newX, loc.y)
-            check = lambda org: org.loc.x <= newX and abs(newLoc.x - org.loc.x) + abs(newLoc.y - org.loc.y) <= distance
-
-        elif dir == ActionTypes.MOVE_NEG_Y:
-            newY = loc.y + distance
-            newLoc = Coord(loc.x, newY)
-            check = lambda org: org.loc.y <= newY and abs(newLoc.x - org.loc.x) + abs(newLoc.y - org.loc.y) <= distance
-
-        elif dir == ActionTypes.MOVE_POS_Y:
-            newY = loc.y - distance
-            newLoc = Coord(loc.x, newY)
-            check = lambda org: org.loc.y >= newY and abs(newLoc.x - org.loc.x) + abs(newLoc.y - org.loc.y) <= distance
-
-        return self.getDensity(check, 100)
-    
-    def getDensity(self, condition, totalPossible: int):
-        return len([org for org in self.organisms if condition(org)]) / totalPossible
-
+    # by the last most that organism took. The cone is the half of a diamond centered `distance` spaces away
+    # (in the direction of the move for x moves, and against it for y moves) that faces back towards the organism
+    def getDensityWithinDistanceDirected(self, loc: Coord, distance: int, dir: ActionTypes) -> float:
+        return self.densityIndex.countInCone(loc.x, loc.y, distance, dir) / 100
 
     # get the distance to the nearest boundary in the given direction, up to the max distance
     def getBoundaryDistance(self, loc: Coord, maxDistance: int, dir: ActionTypes):
-        check = lambda loc: loc.mapString() in self.blockedLocs
-        val = self.getLocConditionWithinDirectedDistance(check, loc, maxDistance, dir)
-        return val
+        if maxDistance == self.boundaryDistance:
+            return self.boundaryDistances[dir, loc.x, loc.y]
+
+        check = lambda x, y: self.blocked[x, y]
+        return self.getLocConditionWithinDirectedDistance(check, loc, maxDistance, dir)
     
+    # the batched equivalent of getBoundaryDistance for the precomputed max distance, given arrays of locations and directions
+    def getBoundaryDistances(self, x: np.ndarray, y: np.ndarray, dirs) -> np.ndarray:
+        return self.boundaryDistances[dirs, x, y]
+
     # get the distance to the nearest organism in the given direction, up to the max distance
     def getOccupiedDistance(self, loc: Coord, maxDistance: int, dir: ActionTypes):
-        check = lambda loc: loc.mapString() in self.organismLocs
-        return self.getLocConditionWithinDirectedDistance(check, loc, maxDistance, dir)
+        return self.occupiedIndex.getDistance(loc.x, loc.y, dir, maxDistance)
+
+    # the batched equivalent of getOccupiedDistance, given arrays of locations and directions
+    def getOccupiedDistances(self, x: np.ndarray, y: np.ndarray, dirs, maxDistance: int) -> np.ndarray:
+        return self.occupiedIndex.getDistances(x, y, dirs, maxDistance)
     
+    # walk from the location one space at a time in the given direction and return how far we got (as a fraction of
+    # the distance) before reaching a space that meets the condition. Spaces outside the grid never meet it
     def getLocConditionWithinDirectedDistance(self, condition, loc: Coord, distance: int, dir: ActionTypes):
-        dirCoord = Coord(0, 0)
+        dirX, dirY = 0, 0
         if dir == ActionTypes.MOVE_NEG_X:
-            dirCoord.x = -1
+            dirX = -1
         elif dir == ActionTypes.MOVE_POS_X:
-            dirCoord.x = 1
+            dirX = 1
         elif dir == ActionTypes.MOVE_NEG_Y:
-            dirCoord.y = -1
+            dirY = -1
         elif dir == ActionTypes.MOVE_POS_Y:
-            dirCoord.y = 1
+            dirY = 1
 
-        testCoord = Coord(loc.x, loc.y)
+        x, y = loc.x, loc.y
         for i in range(distance):
-            testCoord += dirCoord
-            if testCoord.mapString() in self.blockedLocs:
+            x += dirX
+            y += dirY
+            if self.inBounds(x, y) and condition(x, y):
                 return i / distance
         
-        return 1
\ No newline at end of file
+        return 1
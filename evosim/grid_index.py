@@ -0,0 +1,216 @@
+import numpy as np
+from bisect import bisect_left, bisect_right, insort
+
+from .node import ActionTypes
+
+
+# counts how many organisms are inside the regions used by the population senses. It is rebuilt from the grid's
+# occupancy once per step, after which every query is answered from prefix sums instead of by checking every organism:
+#   - a diamond of manhattan radius d around (x, y) becomes a square in the rotated coordinates u = x + y, v = x - y,
+#     so it is a single lookup in a summed area table over (u, v)
+#   - the half diamond "cone" in front of an organism is made up of d + 1 lines perpendicular to the direction it is
+#     facing, so it is d + 1 lookups in the running totals along each column (or row) of the grid
+class DensityIndex:
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.rotatedSize = width + height - 1
+
+        self.rotated = np.zeros((self.rotatedSize + 1, self.rotatedSize + 1), dtype=np.int32)
+        self.columns = np.zeros((width, height + 1), dtype=np.int32)
+        self.rows = np.zeros((height, width + 1), dtype=np.int32)
+
+    def rebuild(self, occupancy: np.ndarray):
+        occupied = occupancy >= 0
+        xs, ys = np.nonzero(occupied)
+
+        # every table has a leading row/column of zeros so that the sum over [lo, hi] is table[hi + 1] - table[lo]
+        rotatedCounts = np.bincount(
+            (xs + ys) * self.rotatedSize + (xs - ys + self.height - 1),
+            minlength=self.rotatedSize * self.rotatedSize
+        ).reshape(self.rotatedSize, self.rotatedSize)
+        self.rotated[1:, 1:] = rotatedCounts.cumsum(axis=0).cumsum(axis=1)
+
+        self.columns[:, 1:] = occupied.cumsum(axis=1)
+        self.rows[:, 1:] = occupied.T.cumsum(axis=1)
+
+    # the number of organisms within a manhattan distance of the given location(s). Works on ints or arrays
+    def countWithinDistance(self, x, y, distance: int):
+        u = x + y
+        v = x - y + self.height - 1
+        uLo = np.clip(u - distance, 0, self.rotatedSize)
+        uHi = np.clip(u + distance + 1, 0, self.rotatedSize)
+        vLo = np.clip(v - distance, 0, self.rotatedSize)
+        vHi = np.clip(v + distance + 1, 0, self.rotatedSize)
+        return self.rotated[uHi, vHi] - self.rotated[uLo, vHi] - self.rotated[uHi, vLo] + self.rotated[uLo, vLo]
+
+    # the number of organisms in the cone in front of a single location (see Grid.getDensityWithinDistanceDirected)
+    def countInCone(self, x: int, y: int, distance: int, dir: int) -> int:
+        centerX, centerY, step = self.getConeStart(x, y, distance, dir)
+        alongX = dir == ActionTypes.MOVE_NEG_X or dir == ActionTypes.MOVE_POS_X
+
+        count = 0
+        for i in range(distance + 1):
+            halfWidth = distance - i
+            if alongX:
+                count += self.sumLine(self.columns, centerX + step * i, centerY - halfWidth, centerY + halfWidth)
+            else:
+                count += self.sumLine(self.rows, centerY + step * i, centerX - halfWidth, centerX + halfWidth)
+        return count
+
+    # the batched equivalent of countInCone, given arrays of locations and directions
+    def countsInCone(self, x: np.ndarray, y: np.ndarray, distance: int, dirs: np.ndarray) -> np.ndarray:
+        centerX, centerY, step = self.getConeStart(x, y, distance, dirs)
+        alongX = (dirs == ActionTypes.MOVE_NEG_X) | (dirs == ActionTypes.MOVE_POS_X)
+
+        counts = np.zeros(len(x), dtype=np.int64)
+        for i in range(distance + 1):
+            halfWidth = distance - i
+            counts += np.where(
+                alongX,
+                self.sumLines(self.columns, centerX + step * i, centerY - halfWidth, centerY + halfWidth),
+                self.sumLines(self.rows, centerY + step * i, centerX - halfWidth, centerX + halfWidth)
+            )
+        return counts
+
+    # the center of the diamond a cone is cut from, and which way to walk from it to get back towards the organism
+    @staticmethod
+    def getConeStart(x, y, distance: int, dirs):
+        negX = dirs == ActionTypes.MOVE_NEG_X
+        posX = dirs == ActionTypes.MOVE_POS_X
+        negY = dirs == ActionTypes.MOVE_NEG_Y
+        posY = dirs == ActionTypes.MOVE_POS_Y
+
+        centerX = x - distance * negX + distance * posX
+        centerY = y + distance * negY - distance * posY
+        step = 1 * (negX | posY) - 1 * (posX | negY)
+        return centerX, centerY, step
+
+    # the number of organisms on one column/row (line) of the grid between lo and hi inclusive
+    @staticmethod
+    def sumLine(table: np.ndarray, line: int, lo: int, hi: int) -> int:
+        if line < 0 or line >= table.shape[0]:
+            return 0
+        length = table.shape[1] - 1
+        return int(table[line, min(max(hi + 1, 0), length)] - table[line, min(max(lo, 0), length)])
+
+    @staticmethod
+    def sumLines(table: np.ndarray, lines: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        valid = (lines >= 0) & (lines < table.shape[0])
+        lines = np.clip(lines, 0, table.shape[0] - 1)
+        length = table.shape[1] - 1
+        sums = table[lines, np.clip(hi + 1, 0, length)] - table[lines, np.clip(lo, 0, length)]
+        return np.where(valid, sums, 0)
+
+
+# finds the nearest organism in a straight line from a location. Every occupied space is kept as a key in two
+# sorted arrays: one ordered row by row (y * width + x) and one ordered column by column (x * height + y). The
+# next organism to the right of a space is then simply the next key in the row ordering (as long as it is still
+# on the same row), and similarly for the other three directions, so each lookup is a binary search.
+# The object engine moves organisms one at a time and looks up one location at a time, so for it the same index is
+# also kept as a sorted list of the occupied positions along each row and column. These are built from the keys the
+# first time a single organism moves, after which moves and lookups only touch the lists of the lines involved
+# (the keys are then only worked out again if a batched lookup needs them)
+class OccupiedLineIndex:
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.rowKeys = np.zeros(0, dtype=np.int64)
+        self.columnKeys = np.zeros(0, dtype=np.int64)
+        self.rows: list[list[int]] = None
+        self.columns: list[list[int]] = None
+        self.keysStale = False
+
+    def rebuild(self, occupancy: np.ndarray):
+        occupied = occupancy >= 0
+        # occupancy is indexed [x, y], so its flat indices are already in column order
+        self.columnKeys = np.flatnonzero(occupied)
+        self.rowKeys = np.flatnonzero(occupied.T)
+        self.rows = None
+        self.columns = None
+        self.keysStale = False
+
+    # update the index for a single organism moving from one space to another
+    def move(self, fromX: int, fromY: int, toX: int, toY: int):
+        self.ensureLines()
+        self.moveInLines(self.rows, fromY, fromX, toY, toX)
+        self.moveInLines(self.columns, fromX, fromY, toX, toY)
+        self.keysStale = True
+
+    @staticmethod
+    def moveInLines(lines: list[list[int]], fromLine: int, fromPosition: int, toLine: int, toPosition: int):
+        line = lines[fromLine]
+        line.pop(bisect_left(line, fromPosition))
+        insort(lines[toLine], toPosition)
+
+    def ensureLines(self):
+        if self.rows is not None:
+            return
+        self.rows = self.splitKeys(self.rowKeys, self.width, self.height)
+        self.columns = self.splitKeys(self.columnKeys, self.height, self.width)
+
+    # split sorted keys into a sorted list of positions for each line
+    @staticmethod
+    def splitKeys(keys: np.ndarray, lineLength: int, numLines: int) -> list[list[int]]:
+        lines = [[] for _ in range(numLines)]
+        for line, position in zip(*np.divmod(keys, lineLength)):
+            lines[line].append(int(position))
+        return lines
+
+    @staticmethod
+    def joinLines(lines: list[list[int]], lineLength: int) -> np.ndarray:
+        return np.array([line * lineLength + position for line, positions in enumerate(lines) for position in positions], dtype=np.int64)
+
+    # return how many spaces away the nearest organism is from each location in the given direction,
+    # or 0 if there are no organisms in that direction. Works on ints or arrays
+    def getOffsets(self, x, y, dir: int):
+        if self.keysStale:
+            self.rowKeys = self.joinLines(self.rows, self.width)
+            self.columnKeys = self.joinLines(self.columns, self.height)
+            self.keysStale = False
+
+        if dir == ActionTypes.MOVE_POS_X or dir == ActionTypes.MOVE_NEG_X:
+            keys, lineLength, line, position = self.rowKeys, self.width, y, x
+        else:
+            keys, lineLength, line, position = self.columnKeys, self.height, x, y
+        key = line * lineLength + position
+
+        if dir == ActionTypes.MOVE_POS_X or dir == ActionTypes.MOVE_POS_Y:
+            index = np.searchsorted(keys, key, side='right')
+        else:
+            index = np.searchsorted(keys, key, side='left') - 1
+
+        found = keys[np.clip(index, 0, max(len(keys) - 1, 0))] if len(keys) else key
+        sameLine = (index >= 0) & (index < len(keys)) & (found // lineLength == line)
+        return np.where(sameLine, np.abs(found - key), 0)
+
+    # the distance to the nearest organism in the given direction(s) as a fraction of the max distance, matching
+    # Grid.getLocConditionWithinDirectedDistance (1 if there are no organisms within the max distance)
+    def getDistances(self, x: np.ndarray, y: np.ndarray, dirs, maxDistance: int) -> np.ndarray:
+        dirs = np.broadcast_to(dirs, x.shape)
+        offsets = np.zeros(len(x), dtype=np.int64)
+        for dir in range(4):
+            facing = dirs == dir
+            if facing.any():
+                offsets[facing] = self.getOffsets(x[facing], y[facing], dir)
+
+        return np.where((offsets > 0) & (offsets <= maxDistance), (offsets - 1) / maxDistance, 1)
+
+    def getDistance(self, x: int, y: int, dir: int, maxDistance: int) -> float:
+        offset = self.getOffset(x, y, dir)
+        return (offset - 1) / maxDistance if 0 < offset <= maxDistance else 1
+
+    # the single location equivalent of getOffsets, from the per line lists
+    def getOffset(self, x: int, y: int, dir: int) -> int:
+        self.ensureLines()
+        if dir == ActionTypes.MOVE_POS_X or dir == ActionTypes.MOVE_NEG_X:
+            line, position = self.rows[y], x
+        else:
+            line, position = self.columns[x], y
+
+        if dir == ActionTypes.MOVE_POS_X or dir == ActionTypes.MOVE_POS_Y:
+            index = bisect_right(line, position)
+            return line[index] - position if index < len(line) else 0
+
+        index = bisect_left(line, position) - 1
+        return position - line[index] if index >= 0 else 0
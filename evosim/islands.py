@@ -0,0 +1,125 @@
+import os
+import json
+import queue
+import numpy as np
+import multiprocessing as mp
+
+from config import Config
+from .simulation import Simulation
+from .organism import Organism
+from .genome import Genome
+from .coord import Coord
+from .genome_similarity import GenerationSimilarity
+from .rng import randomStreams, MIGRATION
+
+
+# a simulation that is one of a ring of islands. Every MIGRATION_INTERVAL generations (never, if it is 0) it sends the
+# genomes of some of its survivors to the next island in the ring and receives the same from the previous one. Genomes
+# are sent as a packed (migrants x genes) code matrix, and the immigrants replace randomly chosen survivors (taking
+# their place in the grid) before the next generation is mated with the island's usual mating strategy
+class IslandSimulation(Simulation):
+    def __init__(self, outputFolder: str, outbox: mp.Queue, inbox: mp.Queue):
+        super().__init__(outputFolder)
+        self.outbox = outbox
+        self.inbox = inbox
+
+    def generationFinished(self, gen: int):
+        interval = Config.get(Config.MIGRATION_INTERVAL)
+        if not interval or (gen + 1) % interval != 0 or gen == Config.get(Config.GENERATIONS) - 1:
+            return
+
+        # every island sends before it receives, so no island waits on one that is itself waiting
+        self.outbox.put(self.chooseEmigrants())
+        self.receiveImmigrants(self.inbox.get())
+
+    def chooseEmigrants(self) -> np.ndarray:
+        numMigrants = min(Config.get(Config.MIGRANTS), len(self.organisms))
+        emigrants = randomStreams.stream(MIGRATION).choice(len(self.organisms), numMigrants, replace=False)
+        return Genome.stack([self.organisms[index].brain.genome for index in emigrants.tolist()])
+
+    def receiveImmigrants(self, codes: np.ndarray):
+        if len(codes) == 0:
+            return
+
+        survivors = self.organisms
+        generator = randomStreams.stream(MIGRATION)
+        replaced = generator.choice(len(survivors), min(len(codes), len(survivors)), replace=False).tolist()
+        nextId = max([org.id for org in survivors], default=-1) + 1
+        for i, immigrantCodes in enumerate(codes):
+            immigrant = Organism(nextId + i, self.grid, Genome(immigrantCodes))
+            if i < len(replaced):
+                immigrant.loc = survivors[replaced[i]].loc
+                survivors[replaced[i]] = immigrant
+            else:
+                # there were fewer survivors than immigrants, so the rest are placed anywhere
+                immigrant.loc = Coord(int(generator.integers(self.grid.width)), int(generator.integers(self.grid.height)))
+                survivors.append(immigrant)
+
+        # the similarity factors are relative to the organisms they were calculated with, so they are worked out
+        # again for the survivors and immigrants together
+        for org in survivors:
+            org.similarity = None
+        GenerationSimilarity(survivors, 3)
+
+
+# evolve ISLANDS separate populations side by side, each with its own grid and simulation in its own process, with
+# survivors periodically migrating around the ring of islands. Each island writes its output to its own folder, and a
+# summary of every island is written to islands_results.json in the output folder
+def runIslands(outputFolder: str, seed: int = None) -> list[dict]:
+    numIslands = Config.get(Config.ISLANDS)
+    if seed is not None:
+        randomStreams.seed(seed)
+    seeds = randomStreams.spawnSeeds(numIslands)
+    inboxes = [mp.Queue() for _ in range(numIslands)]
+    results = mp.Queue()
+
+    islands = []
+    for index in range(numIslands):
+        folder = os.path.join(outputFolder, f'island_{index}')
+        os.makedirs(folder, exist_ok=True)
+        island = mp.Process(target=runIsland, args=(
+            index, dict(Config.configValues), folder, inboxes[(index + 1) % numIslands], inboxes[index],
+            results, seeds[index]
+        ))
+        island.start()
+        islands.append(island)
+
+    summaries = []
+    try:
+        while len(summaries) < numIslands:
+            try:
+                summary = results.get(timeout=1)
+            except queue.Empty:
+                # an island that died without reporting back would leave its neighbour waiting forever
+                if any(island.exitcode not in (None, 0) for island in islands):
+                    raise RuntimeError("an island process exited unexpectedly")
+                continue
+
+            if 'error' in summary:
+                raise RuntimeError(f"island {summary['island']} failed: {summary['error']}")
+            summaries.append(summary)
+    finally:
+        for island in islands:
+            if island.is_alive() and len(summaries) < numIslands:
+                island.terminate()
+            island.join()
+
+    summaries.sort(key=lambda s: s['island'])
+    with open(os.path.join(outputFolder, 'islands_results.json'), 'w') as resultsFile:
+        json.dump({
+            'islands': summaries,
+            'survivors': np.sum([s['survivors'] for s in summaries], axis=0).tolist()
+        }, resultsFile, indent=2)
+    return summaries
+
+# the entry point of an island's process. Each island has its own seed, as they would otherwise all start from the
+# same random state
+def runIsland(index: int, config: dict, folder: str, outbox: mp.Queue, inbox: mp.Queue, results: mp.Queue, seed: np.random.SeedSequence):
+    Config.configValues.update(config)
+    randomStreams.seed(seed)
+
+    try:
+        summary = IslandSimulation(folder, outbox, inbox).runSimulation()
+        results.put({'island': index, **summary})
+    except Exception as e:
+        results.put({'island': index, 'error': repr(e)})
@@ -131,7 +131,6 @@ class Node:
         self.type = type
         self.id = id
         self.connections: List[NodeConnection] = []
-        self.value = 0
         self.willDelete = False
 
     def hasOutput(self):
@@ -140,18 +139,10 @@ class Node:
     def hasInput(self):
         return any(conn.input != self and not conn.input.willDelete for conn in self.connections)
     
-    def applyConnections(self):
-        for conn in self.connections:
-            if conn.output == self:
-                conn.applyConnection()
-
     def removeConnections(self):
         for conn in self.connections:
             conn.remove()
     
-    def reset(self):
-        self.value = 0
-
     def name(self):
         if self.type == NodeType.SENSE:
             return SenseTypes.name(self.id)
@@ -178,10 +169,6 @@ class NodeConnection:
         self.input.connections = [conn for conn in self.input.connections if conn != self]
         self.output.connections = [conn for conn in self.output.connections if conn != self]
 
-    
-    def applyConnection(self):
-        self.output.value += self.input.value * self.weight
-
     def width(self):
         return max(abs(self.weight), .5)
 
@@ -6,9 +6,9 @@ from .genome import Genome
 from .grid import Grid
 from .coord import Coord
 from .node import SenseTypes, ActionTypes
-from .genome_similarity import NFactorGeneticSimilary
-
-import random
+from .genome_similarity import NFactorGeneticSimilary, GenerationSimilarity
+from .sense_field import SenseField
+from .rng import randomStreams, MOVES
 
 class Organism:
     def __init__(self, id: int, grid: Grid, genome: Genome):
@@ -20,86 +20,39 @@ class Organism:
         self.age = 0
         
         self.grid = grid
-        self.similarity: NFactorGeneticSimilary = None
-
-    @staticmethod
-    def gen_random(id: int, grid: Grid):
-        genome = Genome.gen_random()
-        return Organism(id, grid, genome)
-    
-    @staticmethod
-    def gen_from_parents(id: int, grid: Grid, parent: 'Organism', parent2: 'Organism'):
-        genome = Genome.gen_from_parents(parent.brain.genome, parent2.brain.genome)
-        return Organism(id, grid, genome)
-    
-    # perform one complete cycle: reset all the brain nodes, populate sense data, apply all
-    # the node connections to generate actions, and execute those actions
+        self.colorCode = '#000000'
+
+        # the similarity factors are only calculated (for the whole generation at once) when something first asks for them
+        self.similarityFactors: NFactorGeneticSimilary = None
+        self.generationSimilarity: GenerationSimilarity = None
+
+    @property
+    def similarity(self) -> NFactorGeneticSimilary:
+        if self.similarityFactors is None and self.generationSimilarity is not None:
+            self.generationSimilarity.calculate()
+        return self.similarityFactors
+
+    @similarity.setter
+    def similarity(self, similarity: NFactorGeneticSimilary):
+        self.similarityFactors = similarity
+
+    # perform one complete cycle: populate sense data, run it through the brain's connections
+    # to generate actions, and execute those actions
     def performStep(self):
         self.age += 1
-        self.brain.clearNodes()
-        for node in self.brain.senseNodes:
-            node.value = self.getSenseValue(node.id)
+        senses = [self.getSenseValue(senseId) for senseId in self.brain.senseIds]
 
-        actions = self.brain.determineAction()
+        actions = self.brain.determineAction(senses)
         self.executeActions(actions)
 
     # return a value between 0 and 1 that determines how strong a particular node's signal is.
     # for example, if the organism is close to the right edge and we are checking the DISTANCE_FROM_NEAREST_X_EDGE
     # sense, it will return a value close to 0, but if the organism is close to the center it will return 1
     def getSenseValue(self, senseId: int) -> float:
-        if senseId == SenseTypes.X_LOC:
-            return self.loc.x / self.grid.width
-        
-        if senseId == SenseTypes.Y_LOC:
-            return self.loc.y / self.grid.height
+        # senses that only depend on the location and last move (or are the same for everyone) are precomputed by the grid
+        if SenseField.isStatic(senseId) or SenseField.isShared(senseId):
+            return self.grid.senseField.getValue(self.loc.x, self.loc.y, self.lastMove, senseId)
 
-        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_EDGE:
-            nearestX = min(self.loc.x, self.grid.width - self.loc.x) / (self.grid.width / 2)
-            nearestY = min(self.loc.y, self.grid.height - self.loc.y) / (self.grid.height / 2)
-            return min(nearestX, nearestY)
-
-        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_X_EDGE:
-            return min(self.loc.x, self.grid.width - self.loc.x) / (self.grid.width / 2)
-
-        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_Y_EDGE:
-            return min(self.loc.y, self.grid.height - self.loc.y) / (self.grid.height / 2)
-        
-        if senseId == SenseTypes.DISTANCE_FROM_FORWARD_EDGE:
-            if self.lastMove == ActionTypes.MOVE_NEG_X:
-                return self.loc.x
-            if self.lastMove == ActionTypes.MOVE_POS_X:
-                return self.grid.width - self.loc.x
-            if self.lastMove == ActionTypes.MOVE_NEG_Y:
-                return self.loc.y
-            return self.grid.height - self.loc.y
-        
-        if senseId == SenseTypes.DISTANCE_FROM_LR_EDGE:
-            if self.lastMove == ActionTypes.MOVE_NEG_X or self.lastMove == ActionTypes.MOVE_POS_X:
-                return min(self.loc.y, self.grid.height - self.loc.y) / (self.grid.height / 2)
-            
-            return min(self.loc.x, self.grid.width - self.loc.x) / (self.grid.width / 2)
-        
-        if senseId == SenseTypes.DISTANCE_FROM_FORWARD_BOUNDARY:
-            return self.grid.getBoundaryDistance(self.loc, Config.get(Config.SENSE_DISTANCE), self.lastMove)
-        
-        if senseId == SenseTypes.DISTANCE_FROM_LR_BOUNDARY:
-            return min(
-                self.grid.getBoundaryDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.leftDir(self.lastMove)),
-                self.grid.getBoundaryDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.rightDir(self.lastMove))
-            )
-        
-        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_X_BOUNDARY:
-            return min(
-                self.grid.getBoundaryDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.MOVE_NEG_X),
-                self.grid.getBoundaryDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.MOVE_POS_X)
-            )
-
-        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_Y_BOUNDARY:
-            return min(
-                self.grid.getBoundaryDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.MOVE_NEG_Y),
-                self.grid.getBoundaryDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.MOVE_POS_Y)
-            )
-        
         if senseId == SenseTypes.POPULATION_CLOSE:
             return self.grid.getDensityWithinDistance(self.loc, Config.get(Config.SENSE_DISTANCE))
         
@@ -114,9 +67,6 @@ class Organism:
                 self.grid.getOccupiedDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.leftDir(self.lastMove)),
                 self.grid.getOccupiedDistance(self.loc, Config.get(Config.SENSE_DISTANCE), ActionTypes.rightDir(self.lastMove))
             )
-        
-        if senseId == SenseTypes.AGE:
-            return self.age / Config.get(Config.STEPS)
  
     def executeActions(self, actionIds: List[Action]):
         moveActions = [action for action in actionIds if self.actionIsMoveAction(action)]
@@ -134,7 +84,7 @@ class Organism:
 
             # if we need to take a random move then generate one of the other move actions and add it to the list
             if action.id == ActionTypes.MOVE_RANDOM:
-                simpleActions.append(Action(random.randint(0, 3), 0))
+                simpleActions.append(Action(randomStreams.buffered(MOVES).integers(4), 0))
 
             # if we need to take a forward move then generate a move action based on whatever the organism did last
             elif action.id == ActionTypes.MOVE_FORWARD:
@@ -1,125 +1,194 @@
 from PIL import Image, ImageDraw
 import cv2
 import os
-import re
-import random
+import queue
 import pygraphviz as pgv
 import matplotlib.pyplot as plt
 import numpy as np
+import multiprocessing as mp
 
 from .organism import Organism
 from .grid import Grid
+from .obstacle import Obstacle
 from .survivalCriteria import SurvivalCriteria
 from .genome_similarity import genomeSimilarity, calcGenerationColors
+from .rng import randomStreams, STATS
 from config import Config
 
+# records the simulation. Only the small amount of state that is needed to draw the output (organism locations and
+# colors, the graphed brain's connections and the stats) is taken from the simulation, as a snapshot that is handed
+# to an OutputRenderer. By default the renderer runs in a background process fed through a bounded queue, so the
+# simulation carries on while frames are drawn and videos encoded, only waiting if it gets too far ahead
 class Output:
-    def __init__(self, outputFolder: str, grid: Grid, survivalCriteria: SurvivalCriteria):
+    def __init__(self, outputFolder: str, grid: Grid, survivalCriteria: SurvivalCriteria, resume: bool = False):
         self.outputFolder = outputFolder
-        self.cleanFolder()
+        # a resumed run keeps the output of the generations that were recorded before it stopped
+        if not resume:
+            self.cleanFolder()
 
         self.organisms: list[Organism] = []
         self.genNumber: int = 0
 
-        self.video = OutputVideo(outputFolder, grid, survivalCriteria)
-        self.graph = OutputGraph(outputFolder)
         self.stats = OutputStats(outputFolder)
+        self.renderer = OutputRenderer(outputFolder, grid.width, grid.height, grid.obstacles, survivalCriteria)
+
+        self.queue: mp.Queue = None
+        self.worker: mp.Process = None
+        if Config.get(Config.BACKGROUND_OUTPUT):
+            self.queue = mp.Queue(maxsize=Config.get(Config.OUTPUT_QUEUE_SIZE))
+            self.worker = mp.Process(target=runOutputWorker, args=(self.queue, dict(Config.configValues), self.renderer), daemon=True)
+            self.worker.start()
 
     def cleanFolder(self):
         for f in os.listdir(self.outputFolder):
             if f.endswith(".mp4") or f.endswith(".png"):
                 os.remove(os.path.join(self.outputFolder, f))
 
+    # hand a snapshot to the renderer. When it is in the background this waits while the queue is full
+    def send(self, *message):
+        if not self.queue:
+            self.renderer.handle(message)
+            return
+
+        while True:
+            try:
+                self.queue.put(message, timeout=1)
+                return
+            except queue.Full:
+                if not self.worker.is_alive():
+                    raise RuntimeError("the output worker stopped unexpectedly")
+
     def generationStarted(self, organisms: list[Organism], genNumber: int):
         self.organisms = organisms
         self.genNumber = genNumber
         if self.willRecordGeneration():
             calcGenerationColors(self.organisms)
-            self.video.drawFrame()
+            self.send('generationStarted', genNumber, [org.colorCode for org in organisms])
+            self.send('frame', *self.snapshotLocations())
 
     def willRecordGeneration(self) -> bool:
         return self.genNumber == Config.get(Config.GENERATIONS) - 1 or self.genNumber % Config.get(Config.RECORD_FREQUENCY) == 0
     
     def stepComplete(self):
         if self.willRecordGeneration():
-            self.video.drawFrame()
+            self.send('frame', *self.snapshotLocations())
 
     def generationComplete(self, survivors: int):
         self.stats.addStats(self.organisms, survivors)
 
         if self.willRecordGeneration():
-            self.video.saveVideo(self.genNumber)
-            self.graph.drawGraph(self.organisms, self.genNumber)
+            self.send('generationComplete', self.genNumber, OutputGraph.snapshotBrain(OutputGraph.chooseOrganism(self.organisms)))
 
+    # send the stats to be drawn, and wait for all of the output to be finished
     def simulationComplete(self):
-        self.stats.drawGraph()
-        self.stats.drawSimilarityGraph()
-
+        self.send('simulationComplete', self.stats)
+        if self.worker:
+            self.send('stop')
+            self.worker.join()
+            if self.worker.exitcode != 0:
+                raise RuntimeError(f"the output worker failed with exit code {self.worker.exitcode}")
+
+    # the x and y arrays of the current location of every organism in the generation
+    def snapshotLocations(self) -> tuple[np.ndarray, np.ndarray]:
+        x = np.array([org.loc.x for org in self.organisms], dtype=np.int32)
+        y = np.array([org.loc.y for org in self.organisms], dtype=np.int32)
+        return x, y
+
+
+# draws the output from the snapshots sent by Output
+class OutputRenderer:
+    def __init__(self, outputFolder: str, width: int, height: int, obstacles: list[Obstacle], survivalCriteria: SurvivalCriteria):
+        self.video = OutputVideo(outputFolder, width, height, obstacles, survivalCriteria)
+        self.graph = OutputGraph(outputFolder)
 
+    def handle(self, message: tuple):
+        if message[0] == 'generationStarted':
+            self.video.startVideo(message[1], message[2])
+        elif message[0] == 'frame':
+            self.video.drawFrame(message[1], message[2])
+        elif message[0] == 'generationComplete':
+            self.video.saveVideo()
+            self.graph.drawGraph(message[2], message[1])
+        elif message[0] == 'simulationComplete':
+            message[1].drawGraph()
+            if Config.get(Config.FACTOR_STATS):
+                message[1].drawSimilarityGraph()
+
+# the entry point of the background output process
+def runOutputWorker(messages: mp.Queue, config: dict, renderer: OutputRenderer):
+    Config.configValues.update(config)
+    while True:
+        message = messages.get()
+        if message[0] == 'stop':
+            break
+        renderer.handle(message)
+
+
+# streams the frames of each recorded generation straight into an open video. The survival criteria and obstacles
+# never change, so they are drawn once into a background image that each frame is copied from, and the organisms
+# are then stamped onto the copy all at once
 class OutputVideo:
-    def __init__(self, outputFolder: str, grid: Grid, criteria: SurvivalCriteria):
+    def __init__(self, outputFolder: str, width: int, height: int, obstacles: list[Obstacle], criteria: SurvivalCriteria):
         self.outputFolder = outputFolder
-        self.grid = grid
+        self.width = width
+        self.height = height
+        self.obstacles = obstacles
         self.survivalCriteria = criteria
-        self.numImages = 0
+        self.background: np.ndarray = None
+        self.colors: np.ndarray = None
+        self.video: cv2.VideoWriter = None
 
-    def drawFrame(self):
+    # draw the survival criteria and obstacles as a (height x width x 3) BGR image
+    def drawBackground(self) -> np.ndarray:
         scaling = Config.get(Config.IMAGE_SCALING)
-        frame = Image.new('RGB', (self.grid.width * scaling, self.grid.height * scaling), "#ffffff")
-        context = ImageDraw.Draw(frame)
+        image = Image.new('RGB', (self.width * scaling, self.height * scaling), "#ffffff")
+        context = ImageDraw.Draw(image)
 
         self.survivalCriteria.draw(context)
-        for obs in self.grid.obstacles:
+        for obs in self.obstacles:
             obs.draw(context)
 
-        for org in self.grid.organisms:
-            context.rectangle((
-                org.loc.x * scaling, org.loc.y * scaling, org.loc.x * scaling + scaling, org.loc.y * scaling + scaling
-            ), fill=org.similarity.colorCode)
+        return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
 
-        imagePath = f"{self.outputFolder}/image_{self.numImages}.png"
-        frame.save(imagePath)
-        self.numImages += 1
+    # open the video for a generation, with each organism drawn in the given color ('#rrggbb') from then on
+    def startVideo(self, genNumber: int, colors: list[str]):
+        if self.background is None:
+            self.background = self.drawBackground()
 
-    def saveVideo(self, genNumber):
-        scaling = Config.get(Config.IMAGE_SCALING)
-        videoName = f"{self.outputFolder}/output_{genNumber}.mp4"
+        rgb = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] for color in colors], dtype=np.uint8).reshape(-1, 3)
+        self.colors = rgb[:, ::-1]
 
+        height, width = self.background.shape[:2]
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video = cv2.VideoWriter(videoName, fourcc, 15, (self.grid.width * scaling, self.grid.height * scaling))
+        self.video = cv2.VideoWriter(f"{self.outputFolder}/output_{genNumber}.mp4", fourcc, 15, (width, height))
 
-        imagePaths = []
-        for img in os.listdir(self.outputFolder):
-            if img.endswith(".png"):
-                stepNum = int(re.match(f"\D*(\d+)\D*", img).group(1))
-                imagePaths.append({
-                    'name': img,
-                    'step': stepNum
-                })
-        imagePaths.sort(key=lambda x: x['step'])
+    # draw every organism at the given locations and add the frame to the video. Each organism covers the square from
+    # its scaled location to the scaled location of the next space (inclusive, so neighbours overlap by a pixel), with
+    # later organisms drawn over earlier ones
+    def drawFrame(self, x: np.ndarray, y: np.ndarray):
+        scaling = Config.get(Config.IMAGE_SCALING)
+        frame = self.background.copy()
+        height, width = frame.shape[:2]
 
-        for imagePath in imagePaths:
-            video.write(cv2.imread(os.path.join(self.outputFolder, imagePath['name'])))
+        offsets = np.arange(scaling + 1)
+        rows = np.minimum(y[:, None] * scaling + offsets, height - 1)
+        cols = np.minimum(x[:, None] * scaling + offsets, width - 1)
+        frame[rows[:, :, None], cols[:, None, :]] = self.colors[:len(x), None, None, :]
 
-        cv2.destroyAllWindows()
-        video.release()
+        self.video.write(frame)
 
-        self.cleanIntermediaryImages()
-
-    def cleanIntermediaryImages(self):
-        for f in os.listdir(self.outputFolder):
-            if f.startswith('image') and f.endswith(".png"):
-                os.remove(os.path.join(self.outputFolder, f))
-        self.numImages = 0
+    def saveVideo(self):
+        self.video.release()
+        self.video = None
 
 
 class OutputGraph:
     def __init__(self, outputFolder):
         self.outputFolder = outputFolder
 
-    def drawGraph(self, organisms: list[Organism], genNumber: int):
-
-        # find the most average organism to graph (defined by having the highest average similarity)
+    # find the most average organism to graph (defined by having the highest average similarity)
+    @staticmethod
+    def chooseOrganism(organisms: list[Organism]) -> Organism:
         averageOrg: Organism = None
         highestSim = 0
 
@@ -128,14 +197,32 @@ class OutputGraph:
                 averageOrg = org
                 highestSim = org.similarity.totalSimilarity()
 
-        graph = pgv.AGraph(strict=False, directed=True, rankdir="LR")
+        return averageOrg
 
-        for node in [*averageOrg.brain.senseNodes, *averageOrg.brain.innerNodes, *averageOrg.brain.actionNodes]:
-            graph.add_node(node.name(), color=node.color())
+    # return the (name, color) of every node in an organism's brain and the (input name, output name, width, color)
+    # of every connection between them
+    @staticmethod
+    def snapshotBrain(org: Organism) -> tuple[list[tuple], list[tuple]]:
+        nodes = []
+        edges = []
+        for node in [*org.brain.senseNodes, *org.brain.innerNodes, *org.brain.actionNodes]:
+            nodes.append((node.name(), node.color()))
 
             for conn in node.connections:
                     if conn.input == node:
-                        graph.add_edge(node.name(), conn.output.name(), penwidth=conn.width(), color=conn.color(), len=2)
+                        edges.append((node.name(), conn.output.name(), conn.width(), conn.color()))
+
+        return nodes, edges
+
+    def drawGraph(self, brain: tuple[list[tuple], list[tuple]], genNumber: int):
+        nodes, edges = brain
+        graph = pgv.AGraph(strict=False, directed=True, rankdir="LR")
+
+        for name, color in nodes:
+            graph.add_node(name, color=color)
+
+        for inputName, outputName, width, color in edges:
+            graph.add_edge(inputName, outputName, penwidth=width, color=color, len=2)
 
         graph.layout()
         graph.draw(f"{self.outputFolder}/graph_{genNumber}.png")
@@ -168,14 +255,15 @@ class OutputStats:
             self.survivorAverage.append(survivorAverage)
             self.similarityAverage.append(similarityAverage)
 
-        for org in organisms:
-            self.similarityFactors += org.similarity.factors
+        if Config.get(Config.FACTOR_STATS):
+            for org in organisms:
+                self.similarityFactors += org.similarity.factors
 
     def calculateAvgSimilarity(self, organsisms: list[Organism]) -> float:
         similarity = []
-        for _ in range(30):
-            first_genome = organsisms[random.randint(0, len(organsisms) - 1)].brain.genome
-            second_genome = organsisms[random.randint(0, len(organsisms) - 1)].brain.genome
+        for first, second in randomStreams.stream(STATS).integers(len(organsisms), size=(30, 2)).tolist():
+            first_genome = organsisms[first].brain.genome
+            second_genome = organsisms[second].brain.genome
             similarity.append(genomeSimilarity(first_genome, second_genome))
         
         return np.mean(similarity)
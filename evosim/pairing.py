@@ -0,0 +1,58 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# pair up points by repeatedly taking the first unpaired point (in index order) and matching it with its nearest
+# unpaired point, by squared euclidean distance (ties go to the lowest index). Pairing stops once fewer than two points
+# are left. Rather than comparing each point with every other one, the nearest unpaired point is found with a k-d tree,
+# asking for more neighbours until one of them is unpaired. Paired points are left in the tree, so it is rebuilt from
+# only the unpaired points whenever most of the points in it have been paired. Returns a (pairs x 2) array of indices
+def greedyNearestPairs(points: np.ndarray) -> np.ndarray:
+    points = np.asarray(points, dtype=np.float64)
+    paired = np.zeros(len(points), dtype=bool)
+    pairs = []
+
+    treeIndices = np.arange(len(points))
+    tree = cKDTree(points)
+    pairedInTree = 0
+
+    for index in range(len(points)):
+        # stop once there are fewer than two points left to pair
+        if len(pairs) * 2 >= len(points) - 1:
+            break
+
+        if paired[index]:
+            continue
+
+        if pairedInTree * 2 > len(treeIndices):
+            treeIndices = np.flatnonzero(~paired)
+            tree = cKDTree(points[treeIndices])
+            pairedInTree = 0
+
+        match = findNearestUnpaired(points, tree, treeIndices, paired, index)
+        paired[index] = True
+        paired[match] = True
+        pairedInTree += 2
+        pairs.append([index, match])
+
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+# return the index of the unpaired point (other than the given one) nearest to the point at the given index
+def findNearestUnpaired(points: np.ndarray, tree: cKDTree, treeIndices: np.ndarray, paired: np.ndarray, index: int) -> int:
+    k = 8
+    while True:
+        k = min(k, len(treeIndices))
+        _, neighbours = tree.query(points[index], k=k)
+        neighbours = treeIndices[np.atleast_1d(neighbours)]
+
+        # the tree's distances are square rooted, so compare the exact squared distances instead
+        distances = ((points[neighbours] - points[index]) ** 2).sum(axis=1)
+        available = ~paired[neighbours] & (neighbours != index)
+
+        if available.any():
+            closest = distances[available].min()
+            # every other point with the same distance must also have been returned before choosing the lowest index
+            if k == len(treeIndices) or distances.max() > closest:
+                return int(neighbours[available & (distances == closest)].min())
+
+        k *= 2
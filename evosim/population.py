@@ -0,0 +1,134 @@
+import numpy as np
+
+from config import Config
+from .grid import Grid
+from .organism import Organism
+from .coord import Coord
+from .brain import BrainBatch
+from .sense_field import SenseField
+from .node import SenseTypes, ActionTypes
+
+LEFT_DIR = np.array([ActionTypes.leftDir(dir) for dir in range(4)])
+RIGHT_DIR = np.array([ActionTypes.rightDir(dir) for dir in range(4)])
+
+
+# the "array" engine. Instead of asking every Organism to sense, think and move on its own, the state of the
+# whole generation (ids, locations, last moves and ages) is held in contiguous numpy arrays so that each step
+# can be run as a handful of batched operations over the population. The Organism objects are still created
+# (they own the genomes and brains) and are brought back up to date with syncOrganisms() whenever something
+# outside the engine (output, survival criteria, mating) needs to look at them.
+class Population:
+    def __init__(self, organisms: list[Organism], grid: Grid):
+        self.organisms = organisms
+        self.grid = grid
+
+        self.ids = np.array([org.id for org in organisms], dtype=np.int32)
+        self.x = np.array([org.loc.x for org in organisms], dtype=np.int32)
+        self.y = np.array([org.loc.y for org in organisms], dtype=np.int32)
+        self.lastMove = np.array([org.lastMove for org in organisms], dtype=np.int8)
+        self.age = np.array([org.age for org in organisms], dtype=np.int32)
+
+        # the grid's occupancy already holds each organism's index into this population
+        self.occupancy = grid.occupancy
+        self.blocked = grid.blocked
+
+        self.brains = BrainBatch([org.brain for org in organisms])
+        # only calculate the senses that at least one brain in the generation is wired to
+        self.usedSenses = self.brains.usedSenses()
+        grid.senseField.prepare(self.usedSenses)
+
+    def __len__(self):
+        return len(self.organisms)
+
+    # the senses the grid needs to be ready to answer at the start of each step
+    def gridSenses(self) -> list[int]:
+        return self.usedSenses
+
+    # perform one complete step for every organism: calculate all sense values from the state at the start of the step,
+    # run each brain to get the actions it wants to take, then resolve all of the moves at once
+    def performStep(self):
+        self.age += 1
+        senses = self.getSenseValues()
+        actions = self.determineActions(senses)
+        self.executeMoves(actions)
+
+    # return a (organisms x SenseTypes) matrix of sense values. Columns no brain is connected to are left at 0
+    def getSenseValues(self) -> np.ndarray:
+        senses = np.zeros((len(self), SenseTypes.count()))
+
+        precomputed = [senseId for senseId in self.usedSenses if SenseField.isStatic(senseId) or SenseField.isShared(senseId)]
+        if precomputed:
+            senses[:, precomputed] = self.grid.senseField.getValues(self.x, self.y, self.lastMove, precomputed)
+
+        for senseId in self.usedSenses:
+            if senseId not in precomputed:
+                senses[:, senseId] = self.getSenseColumn(senseId)
+        return senses
+
+    # the batched equivalent of Organism.getSenseValue for the senses that depend on the rest of the population
+    def getSenseColumn(self, senseId: int) -> np.ndarray:
+        senseDistance = Config.get(Config.SENSE_DISTANCE)
+        x = self.x
+        y = self.y
+        lastMove = self.lastMove
+
+        if senseId == SenseTypes.POPULATION_CLOSE:
+            return self.grid.densityIndex.countWithinDistance(x, y, senseDistance) / 100
+
+        if senseId == SenseTypes.POPULATION_FORWARD:
+            return self.grid.densityIndex.countsInCone(x, y, senseDistance, lastMove) / 100
+
+        if senseId == SenseTypes.DISTANCE_FROM_FORWARD_ORGANISM:
+            return self.grid.getOccupiedDistances(x, y, lastMove, senseDistance)
+
+        if senseId == SenseTypes.DISTANCE_FROM_LR_ORGANISM:
+            return np.minimum(
+                self.grid.getOccupiedDistances(x, y, LEFT_DIR[lastMove], senseDistance),
+                self.grid.getOccupiedDistances(x, y, RIGHT_DIR[lastMove], senseDistance)
+            )
+
+        return np.zeros(len(self))
+
+    # combine each organism's actions into a proposed move and carry out every move that is to an available space.
+    # As in Organism.executeMoveActions only the four simple move actions change the location, and the last move is
+    # updated even if the move itself fails (to whichever triggered move comes last in the organism's brain). Moves
+    # are resolved against the grid at the start of the step, so a space being vacated this step is not available
+    # yet, and if several organisms propose the same space the one with the lowest index gets it
+    def executeMoves(self, actions: np.ndarray):
+        moveX = actions[:, ActionTypes.MOVE_POS_X].astype(np.int32) - actions[:, ActionTypes.MOVE_NEG_X]
+        moveY = actions[:, ActionTypes.MOVE_POS_Y].astype(np.int32) - actions[:, ActionTypes.MOVE_NEG_Y]
+
+        moveOrder = np.where(actions[:, :4], self.brains.actionOrder[:, :4], -1)
+        moved = np.flatnonzero(moveOrder.max(axis=1) >= 0)
+        self.lastMove[moved] = np.argmax(moveOrder[moved], axis=1)
+
+        proposedX = self.x + moveX
+        proposedY = self.y + moveY
+        candidates = np.flatnonzero(
+            ((moveX != 0) | (moveY != 0))
+            & (proposedX >= 0) & (proposedX < self.grid.width)
+            & (proposedY >= 0) & (proposedY < self.grid.height)
+        )
+        candidates = candidates[
+            (self.occupancy[proposedX[candidates], proposedY[candidates]] < 0)
+            & ~self.blocked[proposedX[candidates], proposedY[candidates]]
+        ]
+
+        _, firstClaims = np.unique(proposedX[candidates] * self.grid.height + proposedY[candidates], return_index=True)
+        movers = candidates[firstClaims]
+
+        self.grid.moveOrganisms(movers, self.x[movers], self.y[movers], proposedX[movers], proposedY[movers])
+        self.x[movers] = proposedX[movers]
+        self.y[movers] = proposedY[movers]
+
+    # run every organism's brain with its row of sense values and return a (organisms x ActionTypes) matrix of the
+    # actions that were triggered
+    def determineActions(self, senses: np.ndarray) -> np.ndarray:
+        return self.brains.determineActions(senses)
+
+    # copy the array state back onto the Organism objects
+    def syncOrganisms(self):
+        for org, x, y, lastMove, age in zip(self.organisms, self.x.tolist(), self.y.tolist(), self.lastMove.tolist(), self.age.tolist()):
+            org.loc = Coord(x, y)
+            org.lastMove = lastMove
+            org.age = age
@@ -0,0 +1,96 @@
+import numpy as np
+
+# every part of the simulation that needs random numbers draws them from its own stream
+GENOME = "genome"
+GRID = "grid"
+ACTIONS = "actions"
+MOVES = "moves"
+MATING = "mating"
+SIMILARITY = "similarity"
+STATS = "stats"
+MIGRATION = "migration"
+STREAMS = [GENOME, GRID, ACTIONS, MOVES, MATING, SIMILARITY, STATS, MIGRATION]
+
+BUFFER_SIZE = 4096
+
+
+# hands out single random numbers from a stream, drawn from the stream's generator a block at a time. This is for the
+# places (mostly in the object engine) that need one number at a time, where asking the generator for each would
+# cost far more than the number itself
+class BufferedStream:
+    def __init__(self, generator: np.random.Generator):
+        self.generator = generator
+        self.buffer = np.zeros(0)
+        self.values: list[float] = []
+        self.position = 0
+
+    # a float in [0, 1)
+    def random(self) -> float:
+        if self.position == len(self.values):
+            self.buffer = self.generator.random(BUFFER_SIZE)
+            self.values = self.buffer.tolist()
+            self.position = 0
+
+        value = self.values[self.position]
+        self.position += 1
+        return value
+
+    # an int from 0 up to (but not including) high
+    def integers(self, high: int) -> int:
+        return int(self.random() * high)
+
+    def getState(self) -> dict:
+        return {'values': self.values[self.position:]}
+
+    def setState(self, state: dict):
+        self.values = state['values']
+        self.buffer = np.array(self.values)
+        self.position = 0
+
+
+# the random number generators of a run. Each subsystem (see STREAMS) has its own independent numpy Generator, all
+# spawned from one seed, so a seeded run can be reproduced exactly and a change to how one subsystem uses random
+# numbers doesn't change the numbers any other gets. Processes that simulate independently of each other (islands
+# and sweep runs) are each given their own child seed with spawnSeeds, so no two of them share a stream
+class RandomStreams:
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    # start every stream again from the given seed (an int or a SeedSequence), or from fresh entropy if it is None
+    def seed(self, seed=None):
+        self.seedSequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.generators = {
+            name: np.random.Generator(np.random.PCG64(child)) for name, child in zip(STREAMS, self.seedSequence.spawn(len(STREAMS)))
+        }
+        self.buffers: dict[str, BufferedStream] = {}
+
+    def stream(self, name: str) -> np.random.Generator:
+        return self.generators[name]
+
+    def buffered(self, name: str) -> BufferedStream:
+        if name not in self.buffers:
+            self.buffers[name] = BufferedStream(self.generators[name])
+        return self.buffers[name]
+
+    # independent seeds for the given number of worker processes
+    def spawnSeeds(self, count: int) -> list[np.random.SeedSequence]:
+        return self.seedSequence.spawn(count)
+
+    # the state of every stream (including any numbers buffered but not yet used), as plain values that can be saved
+    # to a checkpoint
+    def getState(self) -> dict:
+        return {
+            'generators': {name: generator.bit_generator.state for name, generator in self.generators.items()},
+            'buffers': {name: buffer.getState() for name, buffer in self.buffers.items()}
+        }
+
+    def setState(self, state: dict):
+        for name, generatorState in state['generators'].items():
+            self.generators[name].bit_generator.state = generatorState
+
+        self.buffers = {}
+        for name, bufferState in state['buffers'].items():
+            self.buffered(name).setState(bufferState)
+
+
+randomStreams = RandomStreams()
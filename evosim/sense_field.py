@@ -0,0 +1,138 @@
+import numpy as np
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .grid import Grid
+
+from config import Config
+from .node import SenseTypes, ActionTypes
+
+
+# caches the value of every sense that doesn't depend on the other organisms. The "static" senses only depend on
+# an organism's location and the direction of its last move, so they are worked out once per grid for every
+# (x, y, last move) combination and stored in a float32 (static senses x width x height x 4) table. On large grids
+# the table is big, so each sense's part of it is only worked out (and only takes up memory) once a generation's
+# brains use that sense (see prepare). The "shared" senses are the same for every organism in a step, so they are
+# worked out once per step. An already prepared table (for example one in shared memory) can be given instead
+class SenseField:
+    STATIC_SENSES = [
+        SenseTypes.X_LOC,
+        SenseTypes.Y_LOC,
+        SenseTypes.DISTANCE_FROM_NEAREST_EDGE,
+        SenseTypes.DISTANCE_FROM_NEAREST_X_EDGE,
+        SenseTypes.DISTANCE_FROM_NEAREST_Y_EDGE,
+        SenseTypes.DISTANCE_FROM_FORWARD_EDGE,
+        SenseTypes.DISTANCE_FROM_LR_EDGE,
+        SenseTypes.DISTANCE_FROM_FORWARD_BOUNDARY,
+        SenseTypes.DISTANCE_FROM_LR_BOUNDARY,
+        SenseTypes.DISTANCE_FROM_NEAREST_X_BOUNDARY,
+        SenseTypes.DISTANCE_FROM_NEAREST_Y_BOUNDARY
+    ]
+    SHARED_SENSES = [SenseTypes.AGE]
+
+    def __init__(self, grid: 'Grid', table: np.ndarray = None):
+        self.grid = grid
+
+        # the column of the table each static sense is stored in (-1 if the sense is not static)
+        self.columns = np.full(SenseTypes.count(), -1, dtype=np.int32)
+        self.columns[SenseField.STATIC_SENSES] = np.arange(len(SenseField.STATIC_SENSES))
+
+        self.table = table
+        self.prepared = np.ones(len(SenseField.STATIC_SENSES), dtype=bool)
+        if table is None:
+            # zeroed memory isn't actually given to the table until a column is written to
+            self.table = np.zeros((len(SenseField.STATIC_SENSES), grid.width, grid.height, 4), dtype=np.float32)
+            self.prepared[:] = False
+
+        self.sharedValues = np.zeros(SenseTypes.count())
+
+    @staticmethod
+    def isStatic(senseId: int) -> bool:
+        return senseId in SenseField.STATIC_SENSES
+
+    @staticmethod
+    def isShared(senseId: int) -> bool:
+        return senseId in SenseField.SHARED_SENSES
+
+    # work out the columns of the table for any of the given senses that haven't been already
+    def prepare(self, senseIds: list[int]):
+        x = np.arange(self.grid.width)[:, None, None]
+        y = np.arange(self.grid.height)[None, :, None]
+        lastMove = np.arange(4)[None, None, :]
+        for senseId in senseIds:
+            column = self.columns[senseId]
+            if column >= 0 and not self.prepared[column]:
+                self.table[column] = self.computeStaticSense(senseId, x, y, lastMove)
+                self.prepared[column] = True
+
+    # update the shared senses at the start of a step. Every organism in a generation is the same age
+    def setAge(self, age: int):
+        self.sharedValues[SenseTypes.AGE] = age / Config.get(Config.STEPS)
+
+    def getValue(self, x: int, y: int, lastMove: int, senseId: int) -> float:
+        if SenseField.isShared(senseId):
+            return self.sharedValues[senseId]
+        return float(self.table[self.columns[senseId], x, y, lastMove])
+
+    # the batched equivalent of getValue: return a (organisms x senses) matrix for the given static and shared senses
+    def getValues(self, x: np.ndarray, y: np.ndarray, lastMove: np.ndarray, senseIds: list[int]) -> np.ndarray:
+        values = np.empty((len(x), len(senseIds)))
+        static = [i for i, senseId in enumerate(senseIds) if SenseField.isStatic(senseId)]
+        if static:
+            columns = self.columns[[senseIds[i] for i in static]]
+            values[:, static] = self.table[columns[:, None], x, y, lastMove].T
+        for i, senseId in enumerate(senseIds):
+            if SenseField.isShared(senseId):
+                values[:, i] = self.sharedValues[senseId]
+        return values
+
+    # return a value between 0 and 1 that determines how strong a static sense's signal is for arrays of
+    # locations and last moves. See Organism.getSenseValue
+    def computeStaticSense(self, senseId: int, x: np.ndarray, y: np.ndarray, lastMove: np.ndarray) -> np.ndarray:
+        width = self.grid.width
+        height = self.grid.height
+        nearestX = np.minimum(x, width - x) / (width / 2)
+        nearestY = np.minimum(y, height - y) / (height / 2)
+
+        if senseId == SenseTypes.X_LOC:
+            return x / width
+
+        if senseId == SenseTypes.Y_LOC:
+            return y / height
+
+        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_EDGE:
+            return np.minimum(nearestX, nearestY)
+
+        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_X_EDGE:
+            return nearestX
+
+        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_Y_EDGE:
+            return nearestY
+
+        if senseId == SenseTypes.DISTANCE_FROM_FORWARD_EDGE:
+            return np.select(
+                [lastMove == ActionTypes.MOVE_NEG_X, lastMove == ActionTypes.MOVE_POS_X, lastMove == ActionTypes.MOVE_NEG_Y],
+                [x, width - x, y],
+                height - y
+            )
+
+        if senseId == SenseTypes.DISTANCE_FROM_LR_EDGE:
+            movingX = (lastMove == ActionTypes.MOVE_NEG_X) | (lastMove == ActionTypes.MOVE_POS_X)
+            return np.where(movingX, nearestY, nearestX)
+
+        boundaryDistances = self.grid.boundaryDistances
+        if senseId == SenseTypes.DISTANCE_FROM_FORWARD_BOUNDARY:
+            return boundaryDistances[lastMove, x, y]
+
+        if senseId == SenseTypes.DISTANCE_FROM_LR_BOUNDARY:
+            leftDir = np.vectorize(ActionTypes.leftDir)(lastMove)
+            rightDir = np.vectorize(ActionTypes.rightDir)(lastMove)
+            return np.minimum(boundaryDistances[leftDir, x, y], boundaryDistances[rightDir, x, y])
+
+        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_X_BOUNDARY:
+            return np.minimum(boundaryDistances[ActionTypes.MOVE_NEG_X, x, y], boundaryDistances[ActionTypes.MOVE_POS_X, x, y])
+
+        if senseId == SenseTypes.DISTANCE_FROM_NEAREST_Y_BOUNDARY:
+            return np.minimum(boundaryDistances[ActionTypes.MOVE_NEG_Y, x, y], boundaryDistances[ActionTypes.MOVE_POS_Y, x, y])
+
+        raise ValueError(f"{SenseTypes.name(senseId)} is not a static sense")
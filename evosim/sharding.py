@@ -0,0 +1,219 @@
+import os
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+
+from config import Config
+from .grid import Grid, DENSITY_SENSES, OCCUPIED_SENSES
+from .grid_index import DensityIndex, OccupiedLineIndex
+from .sense_field import SenseField
+from .population import Population
+from .organism import Organism
+from .brain import BrainBatch
+from .node import ActionTypes
+from .rng import randomStreams, ACTIONS
+
+# a numpy array backed by a block of shared memory, so that it can be read and written by several processes
+class SharedArray:
+    def __init__(self, memory: shared_memory.SharedMemory, shape: tuple, dtype: str, owner: bool):
+        self.memory = memory
+        self.shape = shape
+        self.dtype = dtype
+        self.owner = owner
+        self.array = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+    @staticmethod
+    def create(shape: tuple, dtype) -> 'SharedArray':
+        dtype = np.dtype(dtype).str
+        memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+        return SharedArray(memory, shape, dtype, True)
+
+    @staticmethod
+    def attach(spec: tuple) -> 'SharedArray':
+        name, shape, dtype = spec
+        return SharedArray(shared_memory.SharedMemory(name=name), shape, dtype, False)
+
+    # what another process needs to attach to the same array
+    def spec(self) -> tuple:
+        return (self.memory.name, self.shape, self.dtype)
+
+    # unmap this process's view of the memory, and free it once every process is done with it if this is the owner.
+    # Other arrays may still be looking at the memory (the grid keeps its shared occupancy until it is discarded), in
+    # which case it is unmapped when they are
+    def close(self):
+        self.array = None
+        try:
+            self.memory.close()
+        except BufferError:
+            pass
+        if self.owner:
+            self.memory.unlink()
+
+
+# the "sharded" engine. The population is stepped as in the array engine, except that sensing and thinking (the bulk
+# of the work) are split between a pool of worker processes, each handling a contiguous shard of the organisms. The
+# grid's occupancy, the static sense table and the population's locations and last moves live in shared memory, so
+# the workers always see the current state without it being sent to them. Each step the workers write the trigger
+# chance of every action into a shared matrix, and the coordinating process then draws the random numbers for the
+# whole population at once and resolves the moves itself, exactly as the array engine does, so given the same seed
+# both engines produce the same results
+class ShardedPopulation(Population):
+    def __init__(self, organisms: list[Organism], grid: Grid, pool: 'ShardPool'):
+        super().__init__(organisms, grid)
+        self.pool = pool
+
+        # move the population state into shared memory, so that the workers see every move
+        for name in ['x', 'y', 'lastMove']:
+            shared = pool.arrays[name].array[:len(organisms)]
+            shared[:] = getattr(self, name)
+            setattr(self, name, shared)
+
+        pool.startGeneration(self.brains)
+
+    # the workers index the grid for the population senses themselves, so the coordinator's grid never needs to
+    def gridSenses(self) -> list[int]:
+        return []
+
+    def performStep(self):
+        self.age += 1
+        triggerChances = self.pool.getTriggerChances(self.grid.age)
+        actions = randomStreams.stream(ACTIONS).random(triggerChances.shape) < triggerChances
+        self.executeMoves(actions)
+
+
+# the worker processes of the sharded engine and the shared memory they work from. The pool is created once for a
+# grid and kept for the whole simulation, and must be closed to stop the workers and free the shared memory
+class ShardPool:
+    def __init__(self, grid: Grid, numWorkers: int = None):
+        self.numWorkers = numWorkers or os.cpu_count()
+        self.count = 0
+        capacity = Config.get(Config.ORGANSISMS)
+
+        self.arrays = {
+            'occupancy': SharedArray.create(grid.occupancy.shape, np.int32),
+            'senseTable': SharedArray.create(grid.senseField.table.shape, grid.senseField.table.dtype),
+            'x': SharedArray.create((capacity,), np.int32),
+            'y': SharedArray.create((capacity,), np.int32),
+            'lastMove': SharedArray.create((capacity,), np.int8),
+            'triggerChances': SharedArray.create((capacity, ActionTypes.count()), np.float64)
+        }
+
+        # the grid works on the shared copies from now on
+        self.arrays['occupancy'].array[:] = grid.occupancy
+        grid.occupancy = self.arrays['occupancy'].array
+        # only the columns of the sense table that have been worked out are copied, so the rest of the shared table
+        # doesn't take up memory until the coordinator prepares them (which the workers then see)
+        prepared = grid.senseField.prepared
+        self.arrays['senseTable'].array[prepared] = grid.senseField.table[prepared]
+        grid.senseField.table = self.arrays['senseTable'].array
+
+        specs = {name: array.spec() for name, array in self.arrays.items()}
+        self.connections: list[Connection] = []
+        self.workers: list[mp.Process] = []
+        for _ in range(self.numWorkers):
+            connection, workerConnection = mp.Pipe()
+            worker = mp.Process(
+                target=runShardWorker, args=(workerConnection, dict(Config.configValues), specs, grid.width, grid.height), daemon=True
+            )
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    # give each worker the brains of its shard of a new generation
+    def startGeneration(self, brains: BrainBatch):
+        self.count = brains.count
+        bounds = np.linspace(0, brains.count, self.numWorkers + 1).astype(int).tolist()
+        for connection, start, end in zip(self.connections, bounds[:-1], bounds[1:]):
+            connection.send(('generation', start, end, brains.shard(start, end)))
+
+    # have every worker calculate the trigger chances for its shard, and return the (organisms x ActionTypes) matrix of them
+    def getTriggerChances(self, age: int) -> np.ndarray:
+        for connection in self.connections:
+            connection.send(('step', age))
+        for connection in self.connections:
+            reply = connection.recv()
+            if reply[0] == 'error':
+                raise RuntimeError(f"shard worker failed: {reply[1]}")
+        return self.arrays['triggerChances'].array[:self.count]
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('stop',))
+        for worker in self.workers:
+            worker.join()
+        for array in self.arrays.values():
+            array.close()
+
+
+# the view of the grid a worker needs to calculate senses: the shared occupancy and sense table, and its own copies
+# of the indexes used by the population senses (only rebuilt when a brain in its shard uses them)
+class ShardGrid:
+    def __init__(self, width: int, height: int, occupancy: np.ndarray, senseTable: np.ndarray):
+        self.width = width
+        self.height = height
+        self.occupancy = occupancy
+        self.senseField = SenseField(self, senseTable)
+        self.densityIndex = DensityIndex(width, height)
+        self.occupiedIndex = OccupiedLineIndex(width, height)
+
+    def stepStarted(self, age: int, usedSenses: list[int]):
+        self.senseField.setAge(age)
+        if any(senseId in usedSenses for senseId in DENSITY_SENSES):
+            self.densityIndex.rebuild(self.occupancy)
+        if any(senseId in usedSenses for senseId in OCCUPIED_SENSES):
+            self.occupiedIndex.rebuild(self.occupancy)
+
+    def getOccupiedDistances(self, x: np.ndarray, y: np.ndarray, dirs, maxDistance: int) -> np.ndarray:
+        return self.occupiedIndex.getDistances(x, y, dirs, maxDistance)
+
+
+# one worker's shard of the population. The senses are calculated by the same code as the array engine
+class PopulationShard(Population):
+    def __init__(self, grid: ShardGrid, brains: BrainBatch, x: np.ndarray, y: np.ndarray, lastMove: np.ndarray):
+        self.organisms = None
+        self.grid = grid
+        self.brains = brains
+        self.usedSenses = brains.usedSenses()
+        self.x = x
+        self.y = y
+        self.lastMove = lastMove
+
+    def __len__(self):
+        return len(self.x)
+
+    def getTriggerChances(self) -> np.ndarray:
+        return self.brains.getTriggerChances(self.getSenseValues())
+
+
+# the entry point of a worker process: wait for a generation's brains, then calculate the trigger chances of the
+# shard whenever a step is started, until told to stop
+def runShardWorker(connection: Connection, config: dict, specs: dict, width: int, height: int):
+    Config.configValues.update(config)
+    arrays = {name: SharedArray.attach(spec) for name, spec in specs.items()}
+    grid = ShardGrid(width, height, arrays['occupancy'].array, arrays['senseTable'].array)
+    shard: PopulationShard = None
+    start, end = 0, 0
+
+    while True:
+        message = connection.recv()
+        if message[0] == 'stop':
+            break
+
+        try:
+            if message[0] == 'generation':
+                _, start, end, brains = message
+                shard = PopulationShard(
+                    grid, brains, arrays['x'].array[start:end], arrays['y'].array[start:end], arrays['lastMove'].array[start:end]
+                )
+            elif message[0] == 'step':
+                grid.stepStarted(message[1], shard.usedSenses)
+                arrays['triggerChances'].array[start:end] = shard.getTriggerChances()
+                connection.send(('done',))
+        except Exception as e:
+            connection.send(('error', repr(e)))
+
+    shard = None
+    grid = None
+    for array in arrays.values():
+        array.close()
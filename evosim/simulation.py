@@ -1,47 +1,143 @@
 from typing import List
-import random
+import numpy as np
 from datetime import datetime
 
 from config import Config
 from .grid import Grid
 from .organism import Organism
+from .genome import Genome
+from .population import Population
+from .sharding import ShardedPopulation, ShardPool
+from .pairing import greedyNearestPairs
+from .checkpoint import Checkpoint
+from .rng import randomStreams, MATING
 from .output import Output
+from .trajectory import TrajectoryRecorder
 from .survivalCriteria import SideSurvialCriteria, SideSurvivalType, CornerSurvivalCriteria
-from .genome_similarity import calcGenerationSimiarity
+from .genome_similarity import GenerationSimilarity, similarityCache
 
 class Simulation:
-    def __init__(self, outputFolder):
+    # when resuming, the run carries on from the checkpoint in the output folder, with the config it was started with
+    def __init__(self, outputFolder, resume: bool = False):
+        self.outputFolder = outputFolder
+        self.checkpoint: Checkpoint = None
+        if resume:
+            self.checkpoint = Checkpoint.load(outputFolder)
+            self.checkpoint.applyConfig()
+
         self.grid = Grid(Config.get(Config.GRID_WIDTH), Config.get(Config.GRID_HEIGHT), Config.get(Config.OBSTACLES))
         self.survivalStrategy = CornerSurvivalCriteria(6)
-        self.output = Output(outputFolder, self.grid, self.survivalStrategy)
+        self.output = Output(outputFolder, self.grid, self.survivalStrategy, resume)
+        self.trajectory: TrajectoryRecorder = None
+        if Config.get(Config.TRAJECTORY):
+            self.trajectory = TrajectoryRecorder(outputFolder, self.grid.width, self.grid.height, resume)
         self.organisms: List[Organism] = []
-
-    def runSimulation(self):
+        self.population: Population = None
+        # the senses the current generation's brains are wired to
+        self.usedSenses: list[int] = []
+        self.shardPool: ShardPool = None
+        if Config.get(Config.ENGINE) == "sharded":
+            self.shardPool = ShardPool(self.grid, Config.get(Config.SHARD_WORKERS))
+
+    # run every generation and return a summary of the run: the number of survivors in each generation and how long it took
+    def runSimulation(self) -> dict:
         start = datetime.now()
-        for gen in range(Config.get(Config.GENERATIONS)):
-            self.createGeneration(gen)
-            self.output.generationStarted(self.organisms, gen)
-
-            for _ in range(Config.get(Config.STEPS)):
-                for organism in self.organisms:
-                    organism.performStep()
-                self.output.stepComplete()
-
-            survivors = self.determineSurvivors()
-            self.output.generationComplete(len(survivors))
-
-            self.organisms = survivors
+        firstGen = self.resumeFromCheckpoint() if self.checkpoint else 0
+        try:
+            for gen in range(firstGen, Config.get(Config.GENERATIONS)):
+                self.runGeneration(gen)
+                self.generationFinished(gen)
+                self.saveCheckpoint(gen)
+        finally:
+            if self.shardPool:
+                self.shardPool.close()
+            if self.trajectory:
+                self.trajectory.close()
 
         self.output.simulationComplete()
         end = datetime.now()
         print(f'Total time {end - start}')
+        print(f'Similarity cache: {similarityCache.hits} hits, {similarityCache.misses} misses ({similarityCache.hitRate():.0%} hit rate)')
+
+        return {
+            'survivors': list(self.output.stats.survivors),
+            'seconds': (end - start).total_seconds()
+        }
+
+    # create a generation, step it through to the end and keep its survivors as the parents of the next one
+    def runGeneration(self, gen: int):
+        self.createGeneration(gen)
+        self.output.generationStarted(self.organisms, gen)
+        if self.trajectory:
+            self.trajectory.generationStarted(gen, self.organisms, *self.getLocations())
+
+        for _ in range(Config.get(Config.STEPS)):
+            self.performStep()
+            self.output.stepComplete()
+            if self.trajectory:
+                self.trajectory.stepComplete(*self.getLocations())
+
+        if self.population:
+            self.population.syncOrganisms()
+
+        survivors = self.determineSurvivors()
+        self.output.generationComplete(len(survivors))
+        if self.trajectory:
+            self.trajectory.generationComplete()
+
+        self.organisms = survivors
+
+    # restore the survivors, stats and random state from the checkpoint, and return the generation to carry on from
+    def resumeFromCheckpoint(self) -> int:
+        self.organisms = self.checkpoint.createSurvivors(self.grid)
+        self.checkpoint.restoreStats(self.output.stats)
+        self.checkpoint.restoreRandomState()
+        return self.checkpoint.generation + 1
+
+    # save a checkpoint every CHECKPOINT_INTERVAL generations, other than after the last one
+    def saveCheckpoint(self, gen: int):
+        interval = Config.get(Config.CHECKPOINT_INTERVAL)
+        if not interval or (gen + 1) % interval != 0 or gen == Config.get(Config.GENERATIONS) - 1:
+            return
+        Checkpoint.capture(gen, self.organisms, self.output.stats).save(self.outputFolder, Config.get(Config.CHECKPOINT_COMPRESSION))
+
+    # the x, y and last move of every organism in the generation, taken straight from the engine's arrays when there are any
+    def getLocations(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.population:
+            return self.population.x, self.population.y, self.population.lastMove
+
+        return (
+            np.array([org.loc.x for org in self.organisms]),
+            np.array([org.loc.y for org in self.organisms]),
+            np.array([org.lastMove for org in self.organisms])
+        )
+
+    # called once a generation's survivors have been chosen, before the next generation is created from them
+    def generationFinished(self, gen: int):
+        pass
+
+    # step every organism once, either one at a time through the reference Organism/Grid objects
+    # or all at once through the array engine
+    def performStep(self):
+        if not self.population:
+            self.grid.stepStarted(self.usedSenses)
+            for organism in self.organisms:
+                organism.performStep()
+            return
+
+        self.grid.stepStarted(self.population.gridSenses())
+        self.population.performStep()
+        # the output draws from the organism objects, so only keep them up to date when it will be looking
+        if self.output.willRecordGeneration():
+            self.population.syncOrganisms()
     
     # creates a set of organsisms (either with random genes or based on parents)
     # and places then randomly in the grid
     def createGeneration(self, generationNumber):
         newOrganisms: List[Organism] = []
         if generationNumber == 0:
-            newOrganisms = [Organism.gen_random(id, self.grid) for id in range(Config.get(Config.ORGANSISMS))]
+            genomes = Genome.gen_random_generation(Config.get(Config.ORGANSISMS))
+            newOrganisms = [Organism(id, self.grid, genome) for id, genome in enumerate(genomes)]
         elif Config.get(Config.MATING_STRATEGY) == 0:
             newOrganisms = self.randomMating(self.organisms)
         elif Config.get(Config.MATING_STRATEGY) == 1:
@@ -49,71 +145,48 @@ class Simulation:
         else:
             newOrganisms = self.locationMating(self.organisms)
         
-        calcGenerationSimiarity(newOrganisms, 3)
+        GenerationSimilarity(newOrganisms, 3)
         self.organisms = newOrganisms
         # the grid will place new organisms in a random starting location
         self.grid.initGeneration(self.organisms)
+        self.usedSenses = sorted({senseId for org in self.organisms for senseId in org.brain.senseIds})
+        self.grid.senseField.prepare(self.usedSenses)
+
+        if Config.get(Config.ENGINE) == "array":
+            self.population = Population(self.organisms, self.grid)
+        elif Config.get(Config.ENGINE) == "sharded":
+            self.population = ShardedPopulation(self.organisms, self.grid, self.shardPool)
 
     # generate a new set of organisms by randomly selecting survivors and splicing their genomes together
     def randomMating(self, survivors: list[Organism]) -> list[Organism]:
-        newOrganisms = []
-        for id in range(Config.get(Config.ORGANSISMS)):
-                parent = survivors[random.randint(0, len(survivors) - 1)]
-                parent2 = survivors[random.randint(0, len(survivors) - 1)]
-                newOrganisms.append(Organism.gen_from_parents(id, self.grid, parent, parent2))
-        return newOrganisms
+        parentPairs = randomStreams.stream(MATING).integers(0, len(survivors), size=(Config.get(Config.ORGANSISMS), 2))
+        return self.createChildren(survivors, parentPairs)
 
     # generate a new set of organisms by matching survivors that are genetically similar to each other
     def geneticSimilarityMating(self, survivors: list[Organism]) -> list[Organism]:
-        def heuristic(s: Organism, p: Organism):
-            return s.similarity.getWeightedDifference(p.similarity)
-
-        return self.mateBasedOnHeuristic(survivors, heuristic)
+        # the difference between two organisms' similarity factors is the squared distance between them
+        return self.mateNearest(survivors, np.array([s.similarity.factors for s in survivors]))
     
     # generate a new set of organisms by matching survivors that are located close to each other
     def locationMating(self, survivors: list[Organism]) -> list[Organism]:
-        def heuristic(s: Organism, p: Organism):
-            return s.loc.weightedDifference(p.loc)
-
-        return self.mateBasedOnHeuristic(survivors, heuristic)
-
-    # generate a new set of organisms by matching survivors together basic upon a given heuristic and then
-    # splicing together their genomes
-    def mateBasedOnHeuristic(self, survivors: list[Organism], heuristic) -> list[Organism]:
-        pairedSurvivors = {}
-        survivorPairs = []
-
-        for survivor in survivors:
-            # we will only end up going through around half of the survivors, as the other half
-            # will be matched, so exit early if we have found all the pairs
-            if len(survivorPairs) * 2 >= len(survivors) - 1:
-                break
-
-            if not survivor.id in pairedSurvivors:
-                match = None
-                matchDifference = None
-
-                # find the organism that has not already been matched that scores the lowest value 
-                # in the given heuristic
-                for potentialMatch in survivors:
-                    if not potentialMatch.id in pairedSurvivors and potentialMatch != survivor:
-                        difference = heuristic(survivor, potentialMatch)
-                        if not matchDifference or difference < matchDifference:
-                            match = potentialMatch
-                            matchDifference = difference
-
-                pairedSurvivors[survivor.id] = True
-                pairedSurvivors[match.id] = True
-                survivorPairs.append([survivor, match])
+        return self.mateNearest(survivors, np.array([[s.loc.x, s.loc.y] for s in survivors]))
+
+    # generate a new set of organisms by matching each survivor (in order) with the closest survivor to it that
+    # hasn't already been matched, given a point for each survivor, and then splicing together their genomes
+    def mateNearest(self, survivors: list[Organism], points: np.ndarray) -> list[Organism]:
+        survivorPairs = greedyNearestPairs(points)
         
-        # iterate through the matches and create a child with the combined genome of the parents. As there will be fewer
+        # create children with the combined genomes of the matched pairs. As there will be fewer
         # paired survivors than organisms in a generation, pairs will end up produciton 2 or more offspring
-        newOrganisms = []
-        for id in range(Config.get(Config.ORGANSISMS)):
-            index = id % len(survivorPairs)
-            newOrganisms.append(Organism.gen_from_parents(id, self.grid, survivorPairs[index][0], survivorPairs[index][1]))
-                
-        return newOrganisms
+        pairForChild = np.arange(Config.get(Config.ORGANSISMS)) % len(survivorPairs)
+        return self.createChildren(survivors, survivorPairs[pairForChild])
+
+    # create a new generation from the survivors and a (children x 2) array of the indices of each child's parents.
+    # The genomes for the whole generation are created in one go from the survivors' genome matrix
+    def createChildren(self, survivors: list[Organism], parentPairs: np.ndarray) -> list[Organism]:
+        parentCodes = Genome.stack([survivor.brain.genome for survivor in survivors])
+        genomes = Genome.gen_generation_from_parents(parentCodes, parentPairs)
+        return [Organism(id, self.grid, genome) for id, genome in enumerate(genomes)]
 
 
     def determineSurvivors(self):
@@ -0,0 +1,77 @@
+import os
+import json
+import itertools
+import numpy as np
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import Config
+from .simulation import Simulation
+from .genome_similarity import similarityCache
+from .rng import randomStreams
+
+SEED = "seed"
+
+
+# expand a parameter grid (a list of values for each Config value, or "seed") into every combination of them
+def expandGrid(parameterGrid: dict[str, list]) -> list[dict]:
+    names = list(parameterGrid)
+    return [dict(zip(names, values)) for values in itertools.product(*[parameterGrid[name] for name in names])]
+
+# the folder a run's output is written to, named after the parameters that vary between runs
+def runFolder(outputFolder: str, index: int, parameters: dict, parameterGrid: dict[str, list]) -> str:
+    name = '_'.join([f'run{index}', *[f'{key}-{value}' for key, value in parameters.items() if len(parameterGrid[key]) > 1]])
+    return os.path.join(outputFolder, name)
+
+# run every combination of parameters in the grid as a separate simulation, spread across a pool of processes (one
+# per core by default). Each run writes its output to its own folder, and the summary of every run is collected into
+# sweep_results.json in the output folder, which is rewritten as each run finishes
+def runSweep(parameterGrid: dict[str, list], outputFolder: str, workers: int = None) -> list[dict]:
+    runs = expandGrid(parameterGrid)
+    baseConfig = dict(Config.configValues)
+    resultsPath = os.path.join(outputFolder, 'sweep_results.json')
+    os.makedirs(outputFolder, exist_ok=True)
+
+    # runs without a seed of their own are each given one spawned from the sweep's streams
+    seeds = randomStreams.spawnSeeds(len(runs))
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(runSweepJob, index, parameters, baseConfig, runFolder(outputFolder, index, parameters, parameterGrid), seeds[index])
+            for index, parameters in enumerate(runs)
+        ]
+
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            results.sort(key=lambda r: r['index'])
+            print(f"Finished run {result['index'] + 1} of {len(runs)}: {result['parameters']}")
+
+            with open(resultsPath, 'w') as resultsFile:
+                json.dump({'grid': parameterGrid, 'runs': results}, resultsFile, indent=2)
+
+    return results
+
+# run a single simulation of a sweep. This runs in a worker process that may already have run other simulations,
+# so the config is reset to the sweep's starting config and anything left over from the last run is cleared first
+def runSweepJob(index: int, parameters: dict, baseConfig: dict, folder: str, seed: np.random.SeedSequence) -> dict:
+    Config.configValues.update(baseConfig)
+    for name, value in parameters.items():
+        if name != SEED:
+            Config.set(name, value)
+
+    randomStreams.seed(parameters.get(SEED, seed))
+
+    similarityCache.clear()
+    plt.close('all')
+    os.makedirs(folder, exist_ok=True)
+
+    result = {'index': index, 'parameters': parameters, 'folder': folder}
+    try:
+        result.update(Simulation(folder).runSimulation())
+    except Exception as e:
+        result['error'] = repr(e)
+    finally:
+        plt.close('all')
+    return result
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from config import Config
+from .organism import Organism
+
+POSITIONS_FILE = "trajectory_positions.npy"
+LAST_MOVES_FILE = "trajectory_last_moves.npy"
+GENOMES_FILE = "trajectory_genomes.npy"
+HASH_BYTES = 16
+
+
+# records the location and last move of every organism after every step of every generation, so that any generation
+# can be looked at (or rendered) later rather than only the ones that were recorded as videos. The records are
+# preallocated .npy files in the output folder that are memory mapped and written in place:
+#   trajectory_positions.npy: int16 (generations x steps + 1 x organisms x 2) x and y of every organism
+#   trajectory_last_moves.npy: int8 (generations x steps + 1 x organisms) last move of every organism
+#   trajectory_genomes.npy: uint8 (generations x organisms x 16) hash of every organism's genome (see Genome.hash)
+# where step 0 is where each generation started, and organisms are in the same order in every record of a generation
+class TrajectoryRecorder:
+    def __init__(self, outputFolder: str, width: int, height: int, resume: bool = False):
+        if max(width, height) > np.iinfo(np.int16).max:
+            raise ValueError(f"a {width} x {height} grid is too large to record trajectories for")
+
+        self.outputFolder = outputFolder
+        generations = Config.get(Config.GENERATIONS)
+        steps = Config.get(Config.STEPS) + 1
+        organisms = Config.get(Config.ORGANSISMS)
+
+        # a resumed run carries on filling in the records it started
+        self.positions = self.openRecord(POSITIONS_FILE, (generations, steps, organisms, 2), np.int16, resume)
+        self.lastMoves = self.openRecord(LAST_MOVES_FILE, (generations, steps, organisms), np.int8, resume)
+        self.genomes = self.openRecord(GENOMES_FILE, (generations, organisms, HASH_BYTES), np.uint8, resume)
+
+        self.genNumber = 0
+        self.stepNumber = 0
+
+    def openRecord(self, fileName: str, shape: tuple, dtype, resume: bool) -> np.memmap:
+        path = os.path.join(self.outputFolder, fileName)
+        if resume and os.path.exists(path):
+            record = np.load(path, mmap_mode='r+')
+            if record.shape == shape and record.dtype == dtype:
+                return record
+        return open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    # record the genomes and starting locations of a new generation
+    def generationStarted(self, genNumber: int, organisms: list[Organism], x: np.ndarray, y: np.ndarray, lastMove: np.ndarray):
+        self.genNumber = genNumber
+        self.stepNumber = 0
+        hashes = b''.join(org.brain.genome.hash for org in organisms)
+        self.genomes[genNumber, :len(organisms)] = np.frombuffer(hashes, dtype=np.uint8).reshape(-1, HASH_BYTES)
+        self.stepComplete(x, y, lastMove)
+
+    def stepComplete(self, x: np.ndarray, y: np.ndarray, lastMove: np.ndarray):
+        positions = self.positions[self.genNumber, self.stepNumber]
+        positions[:len(x), 0] = x
+        positions[:len(y), 1] = y
+        self.lastMoves[self.genNumber, self.stepNumber, :len(lastMove)] = lastMove
+        self.stepNumber += 1
+
+    # write the generation out to the files
+    def generationComplete(self):
+        for record in [self.positions, self.lastMoves, self.genomes]:
+            record.flush()
+
+    def close(self):
+        self.generationComplete()
+        self.positions = None
+        self.lastMoves = None
+        self.genomes = None
+
+
+# open the trajectory recorded in an output folder (read only and memory mapped, so only the parts that are looked at
+# are read from disk), as a dict of the positions, lastMoves and genomes records
+def loadTrajectory(outputFolder: str) -> dict[str, np.ndarray]:
+    return {
+        'positions': np.load(os.path.join(outputFolder, POSITIONS_FILE), mmap_mode='r'),
+        'lastMoves': np.load(os.path.join(outputFolder, LAST_MOVES_FILE), mmap_mode='r'),
+        'genomes': np.load(os.path.join(outputFolder, GENOMES_FILE), mmap_mode='r')
+    }
@@ -1,5 +1,9 @@
 import click
 import evosim.simulation as sim
+import evosim.sweep as sweeper
+import evosim.islands as islands
+from evosim.checkpoint import Checkpoint
+from evosim.rng import randomStreams
 from config import Config
 
 @click.command()
@@ -12,11 +16,88 @@ from config import Config
                 help=f"the number of organisms in each generation (defaults to {Config.get(Config.ORGANSISMS)})")
 @click.option("--genes", '-ge', type=int, default=Config.get(Config.GENES), 
                 help=f"the number of genes in each organism's genome (the number of connections in each organism's name - defaults to {Config.get(Config.GENES)})")
-def cli(folder: str, generations: int, steps: int, organisms: int, genes: int):
+@click.option("--engine", '-e', type=click.Choice(["object", "array", "sharded"]), default=Config.get(Config.ENGINE), required=False,
+                help=f"how each step is simulated: 'object' steps each organism individually, 'array' steps the whole population with numpy, 'sharded' splits the array engine's work between processes (defaults to {Config.get(Config.ENGINE)})")
+@click.option("--shard-workers", '-sw', type=int, default=Config.get(Config.SHARD_WORKERS), required=False,
+                help=f"the number of worker processes for the sharded engine, 0 for one per core (defaults to {Config.get(Config.SHARD_WORKERS)})")
+@click.option("--similarity-metric", '-m', type=click.Choice(["weighted", "hamming"]), default=Config.get(Config.SIMILARITY_METRIC), required=False,
+                help=f"how genetic similarity is measured: 'weighted' matches up the most similar genes, 'hamming' counts the bits that differ (defaults to {Config.get(Config.SIMILARITY_METRIC)})")
+@click.option("--factor-stats/--no-factor-stats", default=Config.get(Config.FACTOR_STATS), required=False,
+                help=f"whether to record the distribution of similarity factors across generations (defaults to {Config.get(Config.FACTOR_STATS)})")
+@click.option("--islands", '-k', 'numIslands', type=int, default=Config.get(Config.ISLANDS), required=False,
+                help=f"the number of populations to evolve side by side in separate processes, each with the given number of organisms (defaults to {Config.get(Config.ISLANDS)})")
+@click.option("--migration-interval", '-mi', type=int, default=Config.get(Config.MIGRATION_INTERVAL), required=False,
+                help=f"how many generations pass between migrations when running islands, 0 to never migrate (defaults to {Config.get(Config.MIGRATION_INTERVAL)})")
+@click.option("--migrants", '-mg', type=int, default=Config.get(Config.MIGRANTS), required=False,
+                help=f"how many survivors each island sends to the next when migrating (defaults to {Config.get(Config.MIGRANTS)})")
+@click.option("--background-output/--no-background-output", default=Config.get(Config.BACKGROUND_OUTPUT), required=False,
+                help=f"whether to draw and encode the recorded generations in a separate process while the simulation continues (defaults to {Config.get(Config.BACKGROUND_OUTPUT)})")
+@click.option("--checkpoint-interval", '-ci', type=int, default=Config.get(Config.CHECKPOINT_INTERVAL), required=False,
+                help=f"how many generations pass between saving a checkpoint to the output folder, 0 to never save one (defaults to {Config.get(Config.CHECKPOINT_INTERVAL)})")
+@click.option("--resume", is_flag=True, default=False,
+                help="carry on the run in the output folder from its last checkpoint, with the settings it was started with (other than the engine, workers and output/checkpoint options)")
+@click.option("--trajectory/--no-trajectory", default=Config.get(Config.TRAJECTORY), required=False,
+                help=f"whether to record where every organism is after every step of every generation to memory-mapped .npy files in the output folder (defaults to {Config.get(Config.TRAJECTORY)})")
+@click.option("--seed", type=int, default=None, required=False,
+                help="the seed for every random number in the run, so that it can be repeated exactly (defaults to a different random seed each run)")
+def cli(folder: str, generations: int, steps: int, organisms: int, genes: int, engine: str, shard_workers: int, similarity_metric: str, factor_stats: bool,
+        numIslands: int, migration_interval: int, migrants: int, background_output: bool,
+        checkpoint_interval: int, resume: bool, trajectory: bool, seed: int):
     Config.set(Config.GENERATIONS, generations)
     Config.set(Config.STEPS, steps)
     Config.set(Config.ORGANSISMS, organisms)
     Config.set(Config.GENES, genes)
+    Config.set(Config.ENGINE, engine)
+    Config.set(Config.SHARD_WORKERS, shard_workers)
+    Config.set(Config.SIMILARITY_METRIC, similarity_metric)
+    Config.set(Config.FACTOR_STATS, factor_stats)
+    Config.set(Config.ISLANDS, numIslands)
+    Config.set(Config.MIGRATION_INTERVAL, migration_interval)
+    Config.set(Config.MIGRANTS, migrants)
+    Config.set(Config.BACKGROUND_OUTPUT, background_output)
+    Config.set(Config.CHECKPOINT_INTERVAL, checkpoint_interval)
+    Config.set(Config.TRAJECTORY, trajectory)
 
-    simul = sim.Simulation(folder)
+    if resume and not Checkpoint.exists(folder):
+        raise click.UsageError(f"there is no checkpoint to resume from in {folder}")
+
+    if numIslands > 1:
+        if resume:
+            raise click.UsageError("island runs can't be resumed")
+        islands.runIslands(folder, seed)
+        return
+
+    randomStreams.seed(seed)
+    simul = sim.Simulation(folder, resume)
     simul.runSimulation()
+
+
+# parse a sweep parameter of the form name=value1,value2,... into the name and its list of values
+def parseSweepParameter(parameter: str) -> tuple[str, list]:
+    name, _, values = parameter.partition('=')
+    if not values:
+        raise click.BadParameter(f"'{parameter}' must be of the form name=value1,value2,...")
+
+    def parseValue(value: str):
+        for valueType in [int, float]:
+            try:
+                return valueType(value)
+            except ValueError:
+                pass
+        return value
+
+    return name, [parseValue(value) for value in values.split(',')]
+
+@click.command()
+@click.argument('folder', required=True)
+@click.option("--param", '-p', 'parameters', multiple=True, required=True,
+                help="a config value (e.g. organisms, genes, mutateChance, matingStrategy) or 'seed' to sweep over, in the form name=value1,value2,... (can be given multiple times)")
+@click.option("--workers", '-w', type=int, default=None, required=False,
+                help="the number of simulations to run at once (defaults to the number of cores)")
+def sweep(folder: str, parameters: tuple[str], workers: int):
+    parameterGrid = dict(parseSweepParameter(parameter) for parameter in parameters)
+    for name in parameterGrid:
+        if name != sweeper.SEED and name not in Config.configValues:
+            raise click.BadParameter(f"'{name}' is not a config value")
+
+    sweeper.runSweep(parameterGrid, folder, workers)
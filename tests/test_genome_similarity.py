@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from config import Config
+from evosim.grid import Grid
+from evosim.genome import Genome
+from evosim.organism import Organism
+from evosim.genome_similarity import codesSimilarity, computeGenomeSimilarity, calcGenerationSimiarity
+from evosim.genome_similarity import calcGenerationColorsDense, calcGenerationColorsGraph
+from evosim.rng import randomStreams
+
+
+# random genomes, along with mutated copies of a few of them so that some pairs are close and have genes that tie
+def similarityGenomes() -> list[Genome]:
+    randomStreams.seed(7)
+    genomes = Genome.gen_random_generation(40)
+    parents = Genome.stack(genomes[:4])[np.arange(40) % 4]
+    pairs = np.stack([np.arange(40), (np.arange(40) + 1) % 40], axis=1)
+    mutateChance = Config.get(Config.MUTATE_CHANCE)
+    Config.set(Config.MUTATE_CHANCE, .3)
+    try:
+        return genomes + Genome.gen_generation_from_parents(parents, pairs)
+    finally:
+        Config.set(Config.MUTATE_CHANCE, mutateChance)
+
+# the batched kernel gives exactly the same similarity as the scalar reference for every pair
+def test_kernel_matches_scalar_reference():
+    genomes = similarityGenomes()
+    first, second = np.triu_indices(len(genomes), k=1)
+    codes = Genome.stack(genomes)
+
+    similarities = codesSimilarity(codes[first], codes[second])
+    expected = [computeGenomeSimilarity(genomes[i], genomes[j]) for i, j in zip(first.tolist(), second.tolist())]
+    assert similarities.tolist() == expected
+
+# when every organism has the same genome, each one is completely similar to every benchmark, with either metric
+@pytest.mark.parametrize("metric", ["weighted", "hamming"])
+def test_generation_similarity_of_a_single_genome(metric: str):
+    randomStreams.seed(7)
+    grid = Grid(20, 20, [])
+    genome = Genome.gen_random_generation(1)[0]
+    organisms = [Organism(id, grid, genome) for id in range(10)]
+
+    similarityMetric = Config.get(Config.SIMILARITY_METRIC)
+    Config.set(Config.SIMILARITY_METRIC, metric)
+    try:
+        calcGenerationSimiarity(organisms, 3)
+    finally:
+        Config.set(Config.SIMILARITY_METRIC, similarityMetric)
+    assert all(org.similarity.factors == [100, 100, 100] for org in organisms)
+
+# a generation of mutated copies of a few parents, so that it has groups of similar (and identical) genomes
+def clusteredOrganisms(grid: Grid, numParents: int, mutateChance: float) -> list[Organism]:
+    parents = Genome.gen_random_codes(numParents)[np.arange(120) % numParents]
+    pairs = np.stack([np.arange(120), np.arange(120)], axis=1)
+    originalChance = Config.get(Config.MUTATE_CHANCE)
+    Config.set(Config.MUTATE_CHANCE, mutateChance)
+    try:
+        genomes = Genome.gen_generation_from_parents(parents, pairs)
+    finally:
+        Config.set(Config.MUTATE_CHANCE, originalChance)
+    return [Organism(id, grid, genome) for id, genome in enumerate(genomes)]
+
+# the sparse graph colouring gives every organism the same color as comparing every pair of organisms
+@pytest.mark.parametrize("numParents", [1, 3, 6, 20])
+@pytest.mark.parametrize("mutateChance", [.01, .3, 1])
+def test_graph_colors_match_dense_colors(numParents: int, mutateChance: float):
+    randomStreams.seed(numParents)
+    grid = Grid(20, 20, [])
+    organisms = clusteredOrganisms(grid, numParents, mutateChance)
+
+    calcGenerationColorsDense(organisms)
+    denseColors = [org.colorCode for org in organisms]
+    for org in organisms:
+        org.colorCode = '#000000'
+    calcGenerationColorsGraph(organisms)
+
+    assert [org.colorCode for org in organisms] == denseColors
@@ -0,0 +1,43 @@
+import numpy as np
+
+from config import Config
+from evosim.grid import Grid
+from evosim.genome import Genome
+from evosim.organism import Organism
+from evosim.population import Population
+from evosim.sharding import ShardedPopulation, ShardPool
+from evosim.rng import randomStreams
+
+
+# step a seeded generation through the given engine and return every organism's final x, y and last move
+def runGeneration(engine: str, steps: int = 30) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    randomStreams.seed(3)
+    grid = Grid(60, 60, [[20, 25, 10, 40]])
+    organisms = [Organism(id, grid, genome) for id, genome in enumerate(Genome.gen_random_generation(Config.get(Config.ORGANSISMS)))]
+    grid.initGeneration(organisms)
+
+    pool = ShardPool(grid, 3) if engine == "sharded" else None
+    try:
+        population = ShardedPopulation(organisms, grid, pool) if pool else Population(organisms, grid)
+        for _ in range(steps):
+            grid.stepStarted(population.gridSenses())
+            population.performStep()
+        return population.x.copy(), population.y.copy(), population.lastMove.copy()
+    finally:
+        if pool:
+            pool.close()
+
+# given the same seed, the sharded engine makes exactly the same moves as the array engine
+def test_sharded_matches_array():
+    organisms = Config.get(Config.ORGANSISMS)
+    Config.set(Config.ORGANSISMS, 300)
+    try:
+        array = runGeneration("array")
+        sharded = runGeneration("sharded")
+    finally:
+        Config.set(Config.ORGANSISMS, organisms)
+
+    for arrayValues, shardedValues in zip(array, sharded):
+        assert np.array_equal(arrayValues, shardedValues)
+    # the organisms actually went somewhere
+    assert len(np.unique(array[2])) > 1